@@ -2,21 +2,52 @@ import os
 import sys
 import json
 import time
+import fcntl
+import ssl
+import socket
+import urlparse
 import datetime
+import tempfile
+from contextlib import contextmanager
 from functools import partial
 
-from omni_api.hackpad import HackpadClient
-from omni_api.jira import JiraClient
-from omni_api.jive import JiveClient
-from omni_api.github import GithubClient
-from omni_api.trello import TrelloClient
+from workflow import metrics
 
-import click
-import pytz
-from workflow import Workflow, ICON_WEB
+with metrics.phase('imports'):
+    from omni_api.hackpad import HackpadClient
+    from omni_api.jira import JiraClient
+    from omni_api.jive import JiveClient
+    from omni_api.github import GithubClient
+    from omni_api.trello import TrelloClient
+
+    import click
+    import pytz
+    import requests
+    from workflow import Workflow, ICON_WEB, ICON_WARNING, daemon, web
+    from omni_client import SOCKET_PATH
 
 TIMEZONE = pytz.timezone('US/Pacific')
 
+# Share Keychain lookups between keystroke processes for this long
+PASSWORD_CACHE_TTL = 60 * 5
+
+# The Trello member changes rarely, so every code path shares one entry
+TRELLO_ME_TTL = 60 * 60
+
+GITHUB_API_URL = 'https://api.github.com/'
+
+# Failures to reach a service at all (web.HostUnreachable is a
+# socket.error). Unlike HTTP errors such as a 401, these are worth
+# answering from the cache.
+CONNECTION_ERRORS = (socket.error, requests.ConnectionError)
+OFFLINE_ERRORS = CONNECTION_ERRORS + (requests.Timeout,)
+# Subclasses of the above that mean the service answered, but its
+# certificate or TLS handshake was refused. Reported as they are.
+SSL_ERRORS = (ssl.SSLError, requests.exceptions.SSLError)
+
+# Remembers unreachable hosts across processes, so they fail fast
+offline = web.OfflineTracker()
+
 
 class AuthKeys(object):
     HACKPAD_CLIENT_ID = 'omniapi_hackpad_client_id'
@@ -39,9 +70,22 @@ class ConfigKeys(object):
 
 
 class Config(object):
+    """
+    JSON settings in `config_save`.
+
+    The parsed file is kept in memory and only re-read when the file on disk
+    is replaced. Writes take an exclusive lock, merge into the latest data on
+    disk and atomically replace the file, so concurrent processes don't lose
+    each other's updates.
+    """
+
     def __init__(self):
         base_path = os.path.split(os.path.realpath(__file__))[0]
         self.config_file = os.path.join(base_path, 'config_save')
+        self.lock_file = self.config_file + '.lock'
+
+        self._snapshot = None
+        self._snapshot_key = None
 
         if not os.path.exists(self.config_file):
             self.init_config()
@@ -54,24 +98,62 @@ class Config(object):
     def init_config(self):
         self.set_config({})
 
+    @contextmanager
+    def _locked(self):
+        with open(self.lock_file, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _file_key(self):
+        # Every write replaces the file, so the inode changes even when
+        # the mtime resolution is too coarse to notice.
+        try:
+            st = os.stat(self.config_file)
+        except OSError:
+            return None
+
+        return (st.st_ino, st.st_mtime, st.st_size)
+
+    def _write(self, dict_):
+        dirname = os.path.dirname(self.config_file)
+        fd, tmp_path = tempfile.mkstemp(prefix='.config_save.', dir=dirname)
+
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(dict_, f)
+            os.rename(tmp_path, self.config_file)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+        self._snapshot = dict_
+        self._snapshot_key = self._file_key()
+
     def set_config(self, dict_):
-        with open(self.config_file, 'w') as f:
-            json.dump(dict_, f)
+        with self._locked():
+            self._write(dict(dict_))
 
     def load_config(self):
-        with open(self.config_file, 'r') as f:
-            return json.load(f)
+        key = self._file_key()
 
-    def set(self, **kwargs):
-        data = self.load_config()
-        data.update(**kwargs)
+        if self._snapshot is None or key != self._snapshot_key:
+            with open(self.config_file, 'r') as f:
+                self._snapshot = json.load(f)
+            self._snapshot_key = key
 
-        self.set_config(data)
+        return self._snapshot
 
-    def get(self, key, enforce=True):
-        data = self.load_config()
+    def set(self, **kwargs):
+        with self._locked():
+            data = dict(self.load_config())
+            data.update(**kwargs)
+            self._write(data)
 
-        value = data.get(key)
+    def get(self, key, enforce=True):
+        value = self.load_config().get(key)
 
         if enforce and not value:
             raise ValueError(
@@ -89,12 +171,15 @@ class ListHandler(object):
     The new way of fetching and displaying lists. Converting over to this.
     """
 
+    # Base URL of the service, so fetches fail fast while it's unreachable
+    api_url = None
+
     def __init__(
         self,
         query='',
         cache_timeout=60 * 10
     ):
-        self.workflow = Workflow()
+        self.workflow = Workflow(password_cache_ttl=PASSWORD_CACHE_TTL)
         self.query = query
         self.cache_timeout = cache_timeout
 
@@ -103,19 +188,61 @@ class ListHandler(object):
         return self.__class__.__name__
 
     def run(self):
+        metrics.set_label(self.__class__.__name__)
         result = self.workflow.run(self._run)
         self.workflow.send_feedback()
         sys.exit(result)
 
     def fetch(self):
+        """
+        Return the items to display. May be a generator, e.g. one wrapping
+        `workflow.web.paginate`.
+        """
         raise NotImplementedError
 
+    def fetch_all(self):
+        return list(self.fetch())
+
+    def fetch_online(self):
+        """
+        `fetch_all`, unless the service was unreachable a moment ago.
+        """
+        address = tracked_address(self.api_url) if self.api_url else None
+
+        if address:
+            offline.check(*address)
+
+        try:
+            return self.fetch_all()
+        except SSL_ERRORS:
+            raise
+        except CONNECTION_ERRORS:
+            if address:
+                offline.failed(*address)
+            raise
+
     def _run(self, workflow):
-        items = workflow.cached_data(
-            self.cache_key,
-            self.fetch,
-            self.cache_timeout
-        )
+        try:
+            items = workflow.cached_data(
+                self.cache_key,
+                self.fetch_online,
+                self.cache_timeout
+            )
+        except SSL_ERRORS:
+            raise
+        except OFFLINE_ERRORS as e:
+            # Show whatever we have, however old
+            items = workflow.cached_data(self.cache_key, max_age=0)
+
+            if items is None:
+                raise
+
+            workflow.logger.warning('Showing cached results: %s', e)
+            workflow.add_item(
+                'Offline: showing cached results',
+                str(e),
+                icon=ICON_WARNING
+            )
 
         if self.query:
             items = self.filtered_items(items, self.query)
@@ -134,6 +261,20 @@ class ListHandler(object):
         )
 
 
+def tracked_address(url):
+    """
+    `(host, port)` of `url` for the offline tracker, or None if requests
+    to it go through a proxy: the host itself may then be unreachable
+    from here even though the service works.
+    """
+    parts = urlparse.urlsplit(url)
+    if web._proxy_for(parts.scheme, parts.netloc):
+        return None
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+
+    return parts.hostname, port
+
+
 def throttled(func):
     def inner(*args, **kwargs):
         key = 'called_{}'.format(func.__name__)
@@ -181,8 +322,29 @@ def age_str(delta):
     return '{} {} ago'.format(age, unit)
 
 
+# Service clients built by this process (or daemon), keyed by class and
+# constructor args so they can keep their HTTP sessions between handlers.
+_clients = {}
+
+
+def shared_client(wf, cls, *args):
+    key = (cls,) + args
+    client = _clients.get(key)
+
+    if client is None:
+        start = time.time()
+        client = _clients[key] = cls(*args)
+        wf.logger.debug(
+            'Built %s in %.1fms', cls.__name__, (time.time() - start) * 1000
+        )
+
+    return client
+
+
 def get_jira_client(wf):
-    return JiraClient(
+    return shared_client(
+        wf,
+        JiraClient,
         config.get(ConfigKeys.JIRA_URL),
         wf.get_password(AuthKeys.JIRA_USERNAME),
         wf.get_password(AuthKeys.JIRA_PASSWORD)
@@ -190,11 +352,17 @@ def get_jira_client(wf):
 
 
 def get_github_client(wf):
-    return GithubClient(wf.get_password(AuthKeys.GITHUB_TOKEN))
+    return shared_client(
+        wf,
+        GithubClient,
+        wf.get_password(AuthKeys.GITHUB_TOKEN)
+    )
 
 
 def get_jive_client(wf):
-    return JiveClient(
+    return shared_client(
+        wf,
+        JiveClient,
         config.get(ConfigKeys.JIVE_URL),
         wf.get_password(AuthKeys.JIVE_USERNAME),
         wf.get_password(AuthKeys.JIVE_PASSWORD)
@@ -202,29 +370,46 @@ def get_jive_client(wf):
 
 
 def get_hackpad_client(wf):
-    return HackpadClient(
+    return shared_client(
+        wf,
+        HackpadClient,
         wf.get_password(AuthKeys.HACKPAD_CLIENT_ID),
         wf.get_password(AuthKeys.HACKPAD_SECRET)
     )
 
 
 def get_trello_client(wf):
-    return TrelloClient(
+    return shared_client(
+        wf,
+        TrelloClient,
         wf.get_password(AuthKeys.TRELLO_API_KEY),
         wf.get_password(AuthKeys.TRELLO_TOKEN)
     )
 
 
 class JiraIssuesBaseHandler(ListHandler):
+    _browse_base = None
+
+    @property
+    def api_url(self):
+        return config.get(ConfigKeys.JIRA_URL)
+
+    @property
+    def browse_base(self):
+        if self._browse_base is None:
+            url_base = config.get(ConfigKeys.JIRA_URL)
+
+            if url_base[-1] == '/':
+                url_base = url_base[:-1]
+
+            self._browse_base = url_base + '/browse/'
+
+        return self._browse_base
+
     def add_item(self, item):
         title = '{}: {}'.format(item.key, item.summary)
         age = 'Updated {}'.format(age_str(item.updated_age))
-        url_base = config.get(ConfigKeys.JIRA_URL)
-
-        if url_base[-1] == '/':
-            url_base = url_base[:-1]
-
-        browse_url = url_base + '/browse/' + item.key
+        browse_url = self.browse_base + item.key
 
         self.workflow.add_item(
             title,
@@ -254,6 +439,8 @@ class GithubRepoBaseHandler(ListHandler):
     Handles Github lists that require a specific repo.
     """
 
+    api_url = GITHUB_API_URL
+
     def __init__(self, repo, *args, **kwargs):
         super(GithubRepoBaseHandler, self).__init__(*args, **kwargs)
 
@@ -321,6 +508,8 @@ class GithubCommitsHandler(GithubRepoBaseHandler):
 
 
 class GithubEmojiHandler(ListHandler):
+    api_url = GITHUB_API_URL
+
     def fetch(self):
         client = get_github_client(self.workflow)
         result = client.get_emoji()
@@ -346,6 +535,10 @@ class GithubEmojiHandler(ListHandler):
 
 
 class MyJiveActivityHandler(ListHandler):
+    @property
+    def api_url(self):
+        return config.get(ConfigKeys.JIVE_URL)
+
     def fetch(self):
         client = get_jive_client(self.workflow)
 
@@ -379,6 +572,8 @@ class MyJiveActivityHandler(ListHandler):
 
 
 class HackpadsHandler(ListHandler):
+    api_url = 'https://hackpad.com/'
+
     def fetch(self):
         client = get_hackpad_client(self.workflow)
 
@@ -403,23 +598,18 @@ class HackpadsHandler(ListHandler):
 def trello_me(wf):
     client = get_trello_client(wf)
 
-    return wf.cached_data('trello_me', client.get_me, 60 * 10)
+    return wf.cached_data('trello_me', client.get_me, TRELLO_ME_TTL)
 
 
 class TrelloBaseHandler(ListHandler):
+    api_url = 'https://api.trello.com/'
+
     @property
     def client(self):
-        return TrelloClient(
-            self.workflow.get_password(AuthKeys.TRELLO_API_KEY),
-            self.workflow.get_password(AuthKeys.TRELLO_TOKEN)
-        )
+        return get_trello_client(self.workflow)
 
     def fetch_me(self):
-        return self.workflow.cached_data(
-            'trello_me',
-            self.client.get_me,
-            60 * 60
-        )
+        return trello_me(self.workflow)
 
     def fetch_my_member_id(self):
         member_id = config.get(ConfigKeys.TRELLO_MEMBER_ID)
@@ -465,7 +655,8 @@ def trello_create_card(query, wf):
 
 
 def run_workflow(func):
-    result = Workflow().run(func)
+    metrics.set_label(getattr(func, '__name__', None) or func.func.__name__)
+    result = Workflow(password_cache_ttl=PASSWORD_CACHE_TTL).run(func)
     sys.exit(result)
 
 
@@ -474,6 +665,24 @@ def cli():
     pass
 
 
+@cli.command('daemon')
+@click.option('--idle-timeout', type=int, default=daemon.IDLE_TIMEOUT)
+def serve(idle_timeout):
+    """
+    Keep handlers and caches warm and answer omni_client.py requests.
+    """
+    def handler(argv):
+        metrics.start()
+
+        try:
+            cli.main(args=argv, prog_name='alfred_omni_api.py')
+        finally:
+            metrics.flush()
+
+    Workflow().logger.debug('Starting daemon')
+    daemon.serve(SOCKET_PATH, handler, idle_timeout)
+
+
 @cli.command()
 @click.option('--boards', is_flag=True)
 @click.option('--createcard', is_flag=True)
@@ -0,0 +1,5 @@
+"""
+Benchmarks for the workflow library, run against local HTTP servers.
+
+Run from the repository root, e.g. ``python -m benchmarks.compression``.
+"""
@@ -0,0 +1,141 @@
+"""
+Cost of getting an omni_api client for every fetch, with and without the
+shared client registry in alfred_omni_api.py, against the fake APIs.
+
+    python -m benchmarks.clients [--calls 20] [--latency fixed:20]
+
+Modes:
+
+    fresh   empty the registry before each fetch, so every fetch builds
+            its client, as the get_*_client functions used to
+    shared  build each client once and reuse it, as they do now
+
+For each service and mode, one process makes --calls fetches through the
+handlers' get_*_client function and reports the mean time to get the
+client ("client ms"), the mean time of the fetch itself ("fetch ms") and
+how many TCP connections the fake server accepted. The fakes speak plain
+HTTP, so the connection count stands in for the TLS handshakes the same
+fetches cost against the real HTTPS APIs: a client that keeps its
+connection pool opens one connection, one that is rebuilt opens one per
+fetch.
+
+Only Jira and Jive are measured, since theirs are the clients whose base
+URL comes from config_save. The sandbox is the one benchmarks.loadtest
+uses.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+
+from benchmarks.fakeapis import (
+    FakeAPIServer, add_fault_arguments, faults_from_args
+)
+from benchmarks.loadtest import ROOT, make_sandbox, sandbox_env
+
+SERVICES = ['jira', 'jive']
+
+MODES = ['fresh', 'shared']
+
+
+def child(service, mode, calls):
+    """
+    Run `calls` fetches in this process and print the results as JSON.
+    """
+    import alfred_omni_api
+    from workflow import Workflow
+
+    wf = Workflow(password_cache_ttl=alfred_omni_api.PASSWORD_CACHE_TTL)
+
+    if service == 'jira':
+        get_client = alfred_omni_api.get_jira_client
+        fetch = lambda client: client.get_users_issues()
+    else:
+        get_client = alfred_omni_api.get_jive_client
+        fetch = lambda client: client.get_activity()
+
+    # Read the passwords into the memo, so both modes time the client only
+    get_client(wf)
+    alfred_omni_api._clients.clear()
+
+    client_times = []
+    fetch_times = []
+
+    for _ in range(calls):
+        if mode == 'fresh':
+            alfred_omni_api._clients.clear()
+
+        start = time.time()
+        client = get_client(wf)
+        client_times.append(time.time() - start)
+
+        start = time.time()
+        fetch(client)
+        fetch_times.append(time.time() - start)
+
+    print(json.dumps({
+        'client': sum(client_times) / calls * 1000,
+        'fetch': sum(fetch_times) / calls * 1000,
+    }))
+
+
+def run_case(root, server, service, mode, calls, extra_env):
+    env = sandbox_env(root, os.path.join(root, 'home'), extra_env)
+    # The sandbox's copy of the workflow, but this checkout's benchmarks
+    paths = [ROOT]
+
+    if env.get('PYTHONPATH'):
+        paths.append(env['PYTHONPATH'])
+
+    env['PYTHONPATH'] = os.pathsep.join(paths)
+    server.reset()
+    output = subprocess.check_output([
+        sys.executable, '-m', 'benchmarks.clients', '--child',
+        service, mode, str(calls)
+    ], cwd=os.path.join(root, 'workflow'), env=env)
+
+    result = json.loads(output.strip().splitlines()[-1])
+    result['connections'] = server.connections
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--calls', type=int, default=20)
+    parser.add_argument('--env', action='append', default=[],
+                        metavar='KEY=VALUE',
+                        help='extra environment for the fetches')
+    parser.add_argument('--child', nargs=3, help=argparse.SUPPRESS)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    if args.child:
+        service, mode, calls = args.child
+        return child(service, mode, int(calls))
+
+    extra_env = dict(item.split('=', 1) for item in args.env)
+    server = FakeAPIServer(faults_from_args(args), args.items)
+    root = make_sandbox(server)
+
+    print('{:<8} {:<8} {:>6} {:>10} {:>10} {:>12}'.format(
+        'service', 'mode', 'calls', 'client ms', 'fetch ms', 'connections'))
+
+    try:
+        for service in SERVICES:
+            for mode in MODES:
+                result = run_case(root, server, service, mode, args.calls,
+                                  extra_env)
+                print('{:<8} {:<8} {:>6} {:>10.2f} {:>10.2f} {:>12}'.format(
+                    service, mode, args.calls, result['client'],
+                    result['fetch'], result['connections']))
+                sys.stdout.flush()
+    finally:
+        server.stop()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
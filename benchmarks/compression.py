@@ -0,0 +1,58 @@
+"""
+Bytes on the wire and latency of `web.get` with and without compression.
+
+    python -m benchmarks.compression [iterations]
+"""
+import sys
+import time
+
+from workflow import web
+
+from benchmarks.localserver import LocalServer
+
+SIZES = [1024, 64 * 1024, 1024 * 1024, 8 * 1024 * 1024]
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def run(session, server, size, accept_encoding, iterations):
+    url = server.url('/json/{}'.format(size))
+    headers = {'Accept-Encoding': accept_encoding}
+    # Warm up the connection and the server's payload cache
+    session.get(url, headers=headers).json()
+    server.reset()
+    timings = []
+
+    for _ in range(iterations):
+        start = time.time()
+        session.get(url, headers=headers).json()
+        timings.append(time.time() - start)
+
+    return server.bytes_sent // iterations, median(timings)
+
+
+def main(iterations=20):
+    server = LocalServer(compress=True)
+    session = web.Session()
+
+    print('{:>10}  {:>8}  {:>12}  {:>10}'.format(
+        'payload', 'encoding', 'wire bytes', 'median ms'))
+
+    try:
+        for size in SIZES:
+            for encoding in ('identity', 'gzip', 'deflate'):
+                wire, latency = run(
+                    session, server, size, encoding, iterations
+                )
+                print('{:>10}  {:>8}  {:>12}  {:>10.2f}'.format(
+                    size, encoding, wire, latency * 1000))
+    finally:
+        session.close()
+        server.stop()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,378 @@
+"""
+Local stand-ins for the Jira, GitHub, Jive, Hackpad and Trello REST APIs,
+with latency and fault injection, for load testing.
+
+    python -m benchmarks.fakeapis --port 8000 --latency lognormal:80,0.6 \
+        --error-rate 0.02 --burst 5
+
+    server = FakeAPIServer(Faults(latency='fixed:50', drop_rate=0.01))
+    server.url('/rest/api/2/search')
+    server.route_counts  # {'jira.search': 12, ...}
+    server.stop()
+
+Routes answer with the response shapes the omni_api clients read:
+
+    Jira      /rest/api/2/search, /rest/api/2/myself
+    GitHub    /repos/<owner>/<repo>/pulls, /repos/<owner>/<repo>/commits,
+              /emojis, /user
+    Jive      /api/core/v3/activities, /api/core/v3/people/@me
+              (with Jive's "throw ..." JSON prefix)
+    Hackpad   /api/1.0/pads/all
+    Trello    /1/members/me, /1/members/<id>/boards, POST /1/cards
+
+Faults, applied to every request before it is routed:
+
+    latency     delay before responding; see `Latency`
+    error_rate  chance that a burst of errors starts
+    burst       requests failed by each burst
+    error_codes statuses returned during bursts; 429 and 503 carry
+                Retry-After: 1
+    drop_rate   chance that the connection is closed without a response
+    slow_body   bytes per second at which bodies are written
+"""
+import json
+import math
+import time
+import random
+import socket
+import argparse
+import threading
+
+from benchmarks.localserver import LocalServer, Handler
+
+UPDATED = '2014-06-01T12:00:00.000+0000'
+
+JIVE_PREFIX = "throw 'allowIllegalResourceCall is false.';\n"
+
+
+class Latency(object):
+    """
+    A latency distribution parsed from a spec, sampled in seconds:
+
+        fixed:MS
+        uniform:LO_MS,HI_MS
+        lognormal:MEDIAN_MS,SIGMA
+        exp:MEAN_MS
+    """
+    def __init__(self, spec='fixed:0'):
+        self.spec = spec
+        kind, _, args = spec.partition(':')
+        self.kind = kind
+        self.args = [float(arg) for arg in args.split(',') if arg]
+
+        if kind not in ('fixed', 'uniform', 'lognormal', 'exp'):
+            raise ValueError('Unknown latency distribution: {}'.format(spec))
+
+    def sample(self):
+        if self.kind == 'fixed':
+            ms = self.args[0]
+        elif self.kind == 'uniform':
+            ms = random.uniform(*self.args)
+        elif self.kind == 'lognormal':
+            ms = random.lognormvariate(math.log(self.args[0]), self.args[1])
+        else:
+            ms = random.expovariate(1.0 / self.args[0])
+
+        return ms / 1000.0
+
+
+class Faults(object):
+    def __init__(self, latency='fixed:0', error_rate=0.0, burst=1,
+                 error_codes=(429, 503), drop_rate=0.0, slow_body=None):
+        self.latency = Latency(latency)
+        self.error_rate = error_rate
+        self.burst = burst
+        self.error_codes = error_codes
+        self.drop_rate = drop_rate
+        self.slow_body = slow_body
+
+        self._burst_left = 0
+        self._lock = threading.Lock()
+
+    def error(self):
+        """
+        The status code to fail the current request with, or None.
+        """
+        with self._lock:
+            if not self._burst_left and random.random() < self.error_rate:
+                self._burst_left = self.burst
+
+            if self._burst_left:
+                self._burst_left -= 1
+                return random.choice(self.error_codes)
+
+        return None
+
+    def drop(self):
+        return random.random() < self.drop_rate
+
+
+def jira_issues(count):
+    return {
+        'startAt': 0,
+        'maxResults': count,
+        'total': count,
+        'issues': [
+            {
+                'id': str(10000 + i),
+                'key': 'PROJ-{}'.format(i),
+                'fields': {
+                    'summary': 'Fix the frobnicator ({})'.format(i),
+                    'updated': UPDATED,
+                    'status': {'name': 'Open'},
+                },
+            }
+            for i in range(count)
+        ],
+    }
+
+
+def github_pulls(owner, repo, count):
+    return [
+        {
+            'number': i,
+            'title': 'Reticulate splines, part {}'.format(i),
+            'html_url': 'https://github.com/{}/{}/pull/{}'.format(
+                owner, repo, i),
+            'state': 'open',
+            'user': {'login': 'octocat'},
+            'updated_at': '2014-06-01T12:00:00Z',
+        }
+        for i in range(count)
+    ]
+
+
+def github_commits(owner, repo, count):
+    return [
+        {
+            'sha': '{:040x}'.format(i),
+            'html_url': 'https://github.com/{}/{}/commit/{:040x}'.format(
+                owner, repo, i),
+            'commit': {
+                'message': 'Tweak the widget ({})'.format(i),
+                'author': {'name': 'Octo Cat', 'date': '2014-06-01T12:00:00Z'},
+            },
+        }
+        for i in range(count)
+    ]
+
+
+def github_emoji(count):
+    return dict(
+        ('emoji{}'.format(i),
+         'https://github.global.ssl.fastly.net/images/icons/emoji/'
+         'emoji{}.png'.format(i))
+        for i in range(count)
+    )
+
+
+def jive_activities(count):
+    return {
+        'list': [
+            {
+                'id': str(i),
+                'verb': 'jive:created',
+                'title': 'Quarterly widget review {}'.format(i),
+                'url': 'https://jive.example.com/docs/DOC-{}'.format(i),
+                'published': UPDATED,
+                'actor': {'displayName': 'Jane Doe'},
+            }
+            for i in range(count)
+        ],
+    }
+
+
+def trello_boards(count):
+    return [
+        {
+            'id': '{:024x}'.format(i),
+            'name': 'Board {}'.format(i),
+            'shortUrl': 'https://trello.com/b/{:08x}'.format(i),
+            'closed': False,
+        }
+        for i in range(count)
+    ]
+
+
+class FakeAPIHandler(Handler):
+    def route(self, method):
+        """
+        Returns (route name, body callable) for the request, or None.
+        """
+        count = self.server.owner.items
+        parts = self.path.split('?')[0].strip('/').split('/')
+
+        if method == 'POST':
+            if parts == ['1', 'cards']:
+                return 'trello.create_card', lambda: {
+                    'id': '{:024x}'.format(random.getrandbits(64)),
+                    'name': 'New card',
+                }
+            return None
+
+        if parts[:3] == ['rest', 'api', '2']:
+            if parts[3:] == ['search']:
+                return 'jira.search', lambda: jira_issues(count)
+            if parts[3:] == ['myself']:
+                return 'jira.myself', lambda: {'name': 'jdoe'}
+        elif parts[0] == 'repos' and len(parts) == 4:
+            owner, repo = parts[1:3]
+            if parts[3] == 'pulls':
+                return 'github.pulls', lambda: github_pulls(owner, repo, count)
+            if parts[3] == 'commits':
+                return 'github.commits', lambda: github_commits(
+                    owner, repo, count)
+        elif parts == ['emojis']:
+            return 'github.emojis', lambda: github_emoji(count)
+        elif parts == ['user']:
+            return 'github.user', lambda: {'login': 'octocat', 'id': 1}
+        elif parts[:3] == ['api', 'core', 'v3']:
+            if parts[3:] == ['activities']:
+                return 'jive.activities', lambda: jive_activities(count)
+            if parts[3:] == ['people', '@me']:
+                return 'jive.me', lambda: {'id': '1', 'displayName': 'Jane'}
+        elif parts == ['api', '1.0', 'pads', 'all']:
+            return 'hackpad.pads', lambda: [
+                'pad{}'.format(i) for i in range(count)]
+        elif parts[:2] == ['1', 'members']:
+            if parts[2:] == ['me']:
+                return 'trello.me', lambda: {
+                    'id': '{:024x}'.format(1), 'username': 'jdoe',
+                    'fullName': 'Jane Doe'}
+            if len(parts) == 4 and parts[3] == 'boards':
+                return 'trello.boards', lambda: trello_boards(count)
+
+        return None
+
+    def handle_api(self, method):
+        owner = self.server.owner
+        faults = owner.faults
+
+        if method == 'POST':
+            length = int(self.headers.get('Content-Length') or 0)
+            self.rfile.read(length)
+
+        route = self.route(method)
+        name = route[0] if route else 'not_found'
+        owner.count_route(name)
+
+        time.sleep(faults.latency.sample())
+
+        if faults.drop():
+            self.close_connection = 1
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+
+        code = faults.error()
+
+        if code:
+            headers = {'Retry-After': '1'} if code in (429, 503) else None
+            self.send_body('{"error": "injected"}', code=code, headers=headers)
+            return
+
+        if not route:
+            self.send_body('{"error": "not found"}', code=404)
+            return
+
+        body = json.dumps(route[1]())
+
+        if name.startswith('jive.'):
+            body = JIVE_PREFIX + body
+
+        self.send_body(body)
+
+    def do_GET(self):
+        self.handle_api('GET')
+
+    def do_POST(self):
+        self.handle_api('POST')
+
+    def send_body(self, body, content_type='application/json', code=200,
+                  headers=None):
+        slow_body = self.server.owner.faults.slow_body
+
+        if not slow_body:
+            return Handler.send_body(self, body, content_type, code, headers)
+
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+
+        self.end_headers()
+        self.wfile.flush()
+        chunk_size = max(1, slow_body // 10)
+
+        for i in range(0, len(body), chunk_size):
+            self.wfile.write(body[i:i + chunk_size])
+            self.wfile.flush()
+            time.sleep(float(chunk_size) / slow_body)
+
+
+class FakeAPIServer(LocalServer):
+    def __init__(self, faults=None, items=50, port=0):
+        self.faults = faults or Faults()
+        self.items = items
+        self.route_counts = {}
+        LocalServer.__init__(self, FakeAPIHandler, port=port)
+
+    def count_route(self, name):
+        with self._lock:
+            self.route_counts[name] = self.route_counts.get(name, 0) + 1
+
+    def reset(self):
+        LocalServer.reset(self)
+
+        with self._lock:
+            self.route_counts = {}
+
+
+def add_fault_arguments(parser):
+    parser.add_argument('--latency', default='fixed:0',
+                        help='e.g. fixed:50, uniform:10,200, '
+                             'lognormal:80,0.6 or exp:100 (milliseconds)')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--burst', type=int, default=1)
+    parser.add_argument('--error-codes', default='429,503',
+                        help='comma-separated statuses for injected errors')
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--slow-body', type=int, default=None,
+                        help='bytes per second')
+    parser.add_argument('--items', type=int, default=50,
+                        help='items in each list response')
+
+
+def faults_from_args(args):
+    return Faults(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        burst=args.burst,
+        error_codes=tuple(int(c) for c in args.error_codes.split(',')),
+        drop_rate=args.drop_rate,
+        slow_body=args.slow_body,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--port', type=int, default=8000)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeAPIServer(faults_from_args(args), args.items, args.port)
+    print('Serving fake APIs at {}'.format(server.url('/')))
+
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print(json.dumps(server.route_counts, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
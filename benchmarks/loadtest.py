@@ -0,0 +1,265 @@
+"""
+Fire many concurrent `omni_client.py` invocations at the fake APIs and
+report throughput, tail latency and upstream request counts.
+
+    python -m benchmarks.loadtest --requests 200 --concurrency 16 \
+        --latency lognormal:80,0.6 --error-rate 0.02 --burst 5
+
+Each run works in a throwaway sandbox: a copy of the workflow whose
+`config_save` points Jira and Jive at the fake server, the stub `security`
+command from benchmarks/bin on PATH standing in for the Keychain (every
+password is "fake-secret"), and its own HOME and TMPDIR
+for the workflow's cache, data and daemon socket. With --cold, every
+invocation gets a fresh HOME, so nothing is cached between them; with
+--daemon, invocations are answered by a warm `alfred_omni_api.py daemon`.
+
+Only the Jira and Jive commands run by default. The GitHub, Hackpad and
+Trello clients talk to their public hosts, so to keep a load test from
+hammering the real services, every invocation's proxy is set to a closed
+local port: requests to anything but the fake server fail at once. Point
+those clients at the fakes, or override the proxy, with --env and
+--command.
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import Queue
+
+from benchmarks.fakeapis import (
+    FakeAPIServer, add_fault_arguments, faults_from_args
+)
+from benchmarks.stats import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKFLOW_FILES = ['alfred_omni_api.py', 'omni_client.py', 'info.plist']
+
+# Commands whose clients are configured to use the fake server
+COMMANDS = [
+    'jira --me',
+    'jive --activity',
+]
+
+# Nothing listens on the discard port, so proxied requests are refused
+BLACKHOLE_PROXY = 'http://127.0.0.1:9'
+
+def make_sandbox(server):
+    root = tempfile.mkdtemp(prefix='omni-loadtest.')
+    workflow_dir = os.path.join(root, 'workflow')
+
+    os.makedirs(workflow_dir)
+    os.makedirs(os.path.join(root, 'home'))
+
+    for name in WORKFLOW_FILES:
+        shutil.copy(os.path.join(ROOT, name), workflow_dir)
+
+    shutil.copytree(
+        os.path.join(ROOT, 'workflow'),
+        os.path.join(workflow_dir, 'workflow'),
+        ignore=shutil.ignore_patterns('*.pyc', '__pycache__')
+    )
+
+    with open(os.path.join(workflow_dir, 'config_save'), 'w') as f:
+        f.write('{{"jira_url": "{0}", "jive_url": "{0}", '
+                '"trello_member_id": "{1}", "trello_board_id": "{1}", '
+                '"trello_list_id": "{1}"}}'.format(
+                    server.url('/'), '{:024x}'.format(1)))
+
+    shutil.copytree(os.path.join(ROOT, 'benchmarks', 'bin'),
+                    os.path.join(root, 'bin'))
+    return root
+
+
+def sandbox_env(root, home, extra):
+    env = dict(os.environ)
+    env.update({
+        'HOME': home,
+        'TMPDIR': root,
+        'PATH': os.path.join(root, 'bin') + os.pathsep + env.get('PATH', ''),
+        'SECURITY_STUB_STORE': os.path.join(root, 'keychain.json'),
+        'SECURITY_STUB_DEFAULT': 'fake-secret',
+    })
+
+    # Fail closed for hosts other than the fake server
+    for name in ('http_proxy', 'https_proxy', 'HTTP_PROXY', 'HTTPS_PROXY'):
+        env[name] = BLACKHOLE_PROXY
+    for name in ('no_proxy', 'NO_PROXY'):
+        env[name] = '127.0.0.1,localhost'
+
+    env.update(extra)
+    return env
+
+
+class Result(object):
+    def __init__(self, command, status, elapsed, stderr):
+        self.command = command
+        self.status = status
+        self.elapsed = elapsed
+        self.stderr = stderr
+
+
+def invoke(root, command, env):
+    start = time.time()
+    process = subprocess.Popen(
+        [sys.executable, 'omni_client.py'] + command.split(),
+        cwd=os.path.join(root, 'workflow'),
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    _, stderr = process.communicate()
+
+    return Result(command, process.returncode, time.time() - start, stderr)
+
+
+def run(root, commands, requests, concurrency, cold, extra_env):
+    jobs = Queue.Queue()
+
+    for i in range(requests):
+        jobs.put((i, commands[i % len(commands)]))
+
+    results = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            try:
+                i, command = jobs.get_nowait()
+            except Queue.Empty:
+                return
+
+            home = os.path.join(root, 'home')
+
+            if cold:
+                home = os.path.join(root, 'home-{}'.format(i))
+                os.makedirs(home)
+
+            result = invoke(root, command, sandbox_env(root, home, extra_env))
+
+            with lock:
+                results.append(result)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.time()
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    return results, time.time() - start
+
+
+def start_daemon(root, extra_env):
+    env = sandbox_env(root, os.path.join(root, 'home'), extra_env)
+    process = subprocess.Popen(
+        [sys.executable, 'alfred_omni_api.py', 'daemon'],
+        cwd=os.path.join(root, 'workflow'),
+        env=env
+    )
+    socket_path = os.path.join(root, 'alfred-omni-api.{}.sock'.format(
+        os.getuid()))
+
+    for _ in range(100):
+        if os.path.exists(socket_path) or process.poll() is not None:
+            break
+        time.sleep(0.05)
+
+    return process
+
+
+def report(results, elapsed, server):
+    ok = [r for r in results if r.status == 0]
+    failed = [r for r in results if r.status != 0]
+    timings = [r.elapsed * 1000 for r in results]
+
+    print('invocations  {:>8}  ({} failed)'.format(len(results), len(failed)))
+    print('throughput   {:>8.1f}  invocations/s'.format(len(results) / elapsed))
+    print('latency ms   p50 {:.0f}  p95 {:.0f}  p99 {:.0f}  max {:.0f}'.format(
+        percentile(timings, 50), percentile(timings, 95),
+        percentile(timings, 99), max(timings)))
+
+    by_command = {}
+
+    for result in results:
+        by_command.setdefault(result.command, []).append(result)
+
+    print('')
+    print('{:<40} {:>5} {:>7} {:>9} {:>9}'.format(
+        'command', 'n', 'failed', 'p50 ms', 'p99 ms'))
+
+    for command, group in sorted(by_command.items()):
+        timings = [r.elapsed * 1000 for r in group]
+        print('{:<40} {:>5} {:>7} {:>9.0f} {:>9.0f}'.format(
+            command, len(group), len([r for r in group if r.status]),
+            percentile(timings, 50), percentile(timings, 99)))
+
+    total = sum(server.route_counts.values())
+    print('')
+    print('upstream requests {} ({:.2f} per invocation)'.format(
+        total, float(total) / max(1, len(results))))
+
+    for name, count in sorted(server.route_counts.items()):
+        print('    {:<24} {:>6}'.format(name, count))
+
+    if failed:
+        print('')
+        print('first failure ({}):'.format(failed[0].command))
+        print(failed[0].stderr.strip()[-2000:])
+
+    return not failed and ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--command', action='append', dest='commands',
+                        help='omni_client.py arguments, e.g. "jira --me". '
+                             'Repeat for a mix; defaults to Jira and Jive.')
+    parser.add_argument('--cold', action='store_true',
+                        help='give every invocation an empty cache')
+    parser.add_argument('--daemon', action='store_true',
+                        help='answer invocations from a warm daemon')
+    parser.add_argument('--env', action='append', default=[],
+                        metavar='KEY=VALUE',
+                        help='extra environment for the invocations')
+    parser.add_argument('--keep', action='store_true',
+                        help="don't delete the sandbox")
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    extra_env = dict(item.split('=', 1) for item in args.env)
+    server = FakeAPIServer(faults_from_args(args), args.items)
+    root = make_sandbox(server)
+    daemon = start_daemon(root, extra_env) if args.daemon else None
+
+    try:
+        results, elapsed = run(
+            root, args.commands or COMMANDS, args.requests, args.concurrency,
+            args.cold, extra_env
+        )
+        success = report(results, elapsed, server)
+    finally:
+        if daemon:
+            daemon.terminate()
+            daemon.wait()
+
+        server.stop()
+
+        if args.keep:
+            print('sandbox: {}'.format(root))
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+    sys.exit(0 if success else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""
+A threaded HTTP/1.1 server on localhost for benchmarking `workflow.web`.
+
+    server = LocalServer()
+    web.get(server.url('/json/65536'))
+    server.bytes_sent  # bytes written to sockets, headers included
+    server.connections  # TCP connections accepted
+    server.stop()
+
+Routes:
+
+    /json/<size>    JSON array of roughly <size> bytes. Compressed with
+                    gzip or deflate when the client accepts it and the
+                    server was started with compress=True. Compressed
+                    bodies are cached, so only the client's decompression
+                    shows up in timings.
+
+    /flaky/<name>/<n>   Fails the first <n> requests for <name>, then
+                        answers 200. Failures alternate between a 503 and
+                        dropping the connection without a response.
+                        server.attempts[name] counts the requests.
+
+    /slow/<ms>      Waits <ms> milliseconds before answering.
+
+    POST /sink      Reads and discards the request body, then answers
+                    {"received": <bytes>}.
+"""
+import json
+import time
+import zlib
+import gzip
+import socket
+import threading
+import cStringIO
+import BaseHTTPServer
+import SocketServer
+
+
+def json_payload(size):
+    """
+    A JSON array of API-ish records, roughly `size` bytes long.
+    """
+    record = {
+        'id': 0,
+        'key': 'PROJ-0',
+        'summary': 'Fix the frobnicator when the widget is reticulated',
+        'url': 'https://example.com/browse/PROJ-0',
+        'updated': '2014-06-01T12:00:00.000+0000',
+    }
+    per_record = len(json.dumps(record)) + 2
+    records = []
+
+    for i in range(max(1, size // per_record)):
+        record = dict(record, id=i, key='PROJ-{}'.format(i))
+        records.append(record)
+
+    return json.dumps(records)
+
+
+def gzip_bytes(data):
+    buf = cStringIO.StringIO()
+
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(data)
+
+    return buf.getvalue()
+
+
+class CountingWriter(object):
+    """
+    Wraps a socket file and adds bytes written to the server's total.
+    """
+    def __init__(self, wfile, server):
+        self._wfile = wfile
+        self._server = server
+
+    def write(self, data):
+        self._server.count(len(data))
+        self._wfile.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._wfile, name)
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Buffer each response into one write, or delayed ACKs add ~40ms
+    wbufsize = -1
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        # Otherwise the tail of a small response on a kept-alive
+        # connection waits for the client's delayed ACK (~40ms)
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.wfile = CountingWriter(self.wfile, self.server.owner)
+        self.server.owner.connected()
+
+    def send_body(self, body, content_type='application/json', code=200,
+                  headers=None):
+        content_encoding = None
+        accepted = self.headers.get('Accept-Encoding', '')
+
+        if self.server.owner.compress:
+            if 'gzip' in accepted:
+                content_encoding = 'gzip'
+            elif 'deflate' in accepted:
+                content_encoding = 'deflate'
+
+        if content_encoding:
+            body = self.server.owner.compressed(body, content_encoding)
+
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+
+        if content_encoding:
+            self.send_header('Content-Encoding', content_encoding)
+
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.owner.requests += 1
+        parts = self.path.split('?')[0].strip('/').split('/')
+
+        if parts[0] == 'json' and len(parts) == 2:
+            self.send_body(self.server.owner.payload(int(parts[1])))
+        elif parts[0] == 'flaky' and len(parts) == 3:
+            self.flaky(parts[1], int(parts[2]))
+        elif parts[0] == 'slow' and len(parts) == 2:
+            time.sleep(int(parts[1]) / 1000.0)
+            self.send_body('{}')
+        else:
+            self.send_body('{}', code=404)
+
+
+    def do_POST(self):
+        self.server.owner.requests += 1
+        remaining = int(self.headers.get('Content-Length') or 0)
+        received = 0
+
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 65536))
+            if not chunk:
+                break
+            received += len(chunk)
+            remaining -= len(chunk)
+
+        if self.path.split('?')[0] == '/sink':
+            self.send_body(json.dumps({'received': received}))
+        else:
+            self.send_body('{}', code=404)
+
+    def flaky(self, name, failures):
+        attempt = self.server.owner.attempt(name)
+
+        if attempt > failures:
+            self.send_body(json.dumps({'attempts': attempt}))
+        elif attempt % 2:
+            self.send_body('{}', code=503)
+        else:
+            self.close_connection = 1
+            self.connection.shutdown(socket.SHUT_RDWR)
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class LocalServer(object):
+    def __init__(self, handler=Handler, compress=False, port=0):
+        self.compress = compress
+        self.requests = 0
+        self.bytes_sent = 0
+        self.connections = 0
+        self.attempts = {}
+        self._payloads = {}
+        self._compressed = {}
+        self._lock = threading.Lock()
+
+        self.httpd = _Server(('127.0.0.1', port), handler)
+        self.httpd.owner = self
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def url(self, path):
+        return 'http://127.0.0.1:{}{}'.format(self.port, path)
+
+    def count(self, nbytes):
+        with self._lock:
+            self.bytes_sent += nbytes
+
+    def connected(self):
+        with self._lock:
+            self.connections += 1
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes_sent = 0
+            self.connections = 0
+            self.attempts = {}
+
+    def attempt(self, name):
+        with self._lock:
+            self.attempts[name] = self.attempts.get(name, 0) + 1
+            return self.attempts[name]
+
+    def payload(self, size):
+        if size not in self._payloads:
+            self._payloads[size] = json_payload(size)
+
+        return self._payloads[size]
+
+    def compressed(self, body, content_encoding):
+        key = (hash(body), len(body), content_encoding)
+
+        if key not in self._compressed:
+            if content_encoding == 'gzip':
+                self._compressed[key] = gzip_bytes(body)
+            else:
+                self._compressed[key] = zlib.compress(body)
+
+        return self._compressed[key]
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
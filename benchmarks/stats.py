@@ -0,0 +1,20 @@
+"""
+Summary statistics shared by the benchmarks.
+"""
+
+
+def percentile(values, pct):
+    """
+    The `pct` percentile (nearest rank) of `values`.
+    """
+    values = sorted(values)
+
+    if not values:
+        return float('nan')
+
+    index = int(round(pct / 100.0 * len(values) + 0.5)) - 1
+    return values[max(0, min(index, len(values) - 1))]
+
+
+def median(values):
+    return percentile(values, 50)
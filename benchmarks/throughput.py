@@ -0,0 +1,204 @@
+"""
+Throughput, tail latency and memory of `workflow.web` against a local
+server, across payload sizes, compression, connection reuse and streaming.
+
+    python -m benchmarks.throughput [--sizes 1K,1M] [--save before.json]
+    python -m benchmarks.throughput --compare before.json
+
+Cases:
+
+    get        session.get(url).json() on a kept-alive connection
+    get-fresh  the same with a new Session, so a new connection, each time
+    stream     session.get(url, stream=True).iter_json(), body never whole
+    post       session.post(sink, data=payload).json() on a kept-alive
+               connection (uncompressed)
+
+Each case runs in its own process so memory figures don't leak between
+cases. Python 2 can't count allocations, so memory is reported as the
+growth of the peak resident set over the process's baseline ("peak MB")
+and as a multiple of the payload size ("x payload"). The multiple is how
+many copies of the payload, decoded objects included, were alive at once.
+"""
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+
+from benchmarks.localserver import LocalServer
+from benchmarks.stats import percentile
+
+SIZES = ['1K', '64K', '1M', '8M', '50M']
+
+CASES = ['get', 'get-fresh', 'stream', 'post']
+
+ENCODINGS = ['identity', 'gzip']
+
+# Stop repeating a case after this many seconds, once it has run MIN_RUNS
+TIME_BUDGET = 2.0
+MIN_RUNS = 3
+MAX_RUNS = 500
+
+UNITS = {'K': 1024, 'M': 1024 * 1024}
+
+
+def parse_size(text):
+    if text[-1].upper() in UNITS:
+        return int(text[:-1]) * UNITS[text[-1].upper()]
+    return int(text)
+
+
+def max_rss():
+    """
+    Peak resident set size of this process in bytes.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if sys.platform == 'darwin':
+        return rss
+
+    return rss * 1024
+
+
+def child(base_url, case, encoding, size):
+    """
+    Run one case in this process and print its results as JSON.
+    """
+    from workflow import web
+
+    url = '{}/json/{}'.format(base_url, size)
+    sink = '{}/sink'.format(base_url)
+    headers = {'Accept-Encoding': encoding}
+    session = web.Session(retries=0)
+    body = None
+
+    if case == 'post':
+        body = session.get(url, headers=headers).content
+
+    def once():
+        if case == 'get':
+            return session.get(url, headers=headers).json()
+        elif case == 'get-fresh':
+            with web.Session(retries=0) as fresh:
+                return fresh.get(url, headers=headers).json()
+        elif case == 'stream':
+            r = session.get(url, headers=headers, stream=True)
+            return sum(1 for _ in r.iter_json())
+        else:
+            return session.post(sink, data=body, headers={
+                'Content-Type': 'application/json'}).json()
+
+    baseline = max_rss()
+    timings = []
+    started = time.time()
+
+    while len(timings) < MAX_RUNS:
+        start = time.time()
+        once()
+        timings.append(time.time() - start)
+
+        if (len(timings) >= MIN_RUNS and
+                time.time() - started > TIME_BUDGET):
+            break
+
+    session.close()
+    print(json.dumps({
+        'runs': len(timings),
+        'rps': len(timings) / sum(timings),
+        'p50': percentile(timings, 50) * 1000,
+        'p99': percentile(timings, 99) * 1000,
+        'peak': max_rss() - baseline,
+    }))
+
+
+def warm_up(server, size):
+    """
+    Have the server build and compress the payload before any timing.
+    """
+    from workflow import web
+
+    # Not the module-level session, whose HTTP cache would store the payload
+    with web.Session() as session:
+        for encoding in ENCODINGS:
+            session.get(server.url('/json/{}'.format(size)),
+                        headers={'Accept-Encoding': encoding}).content
+
+
+def run_case(server, case, encoding, size):
+    output = subprocess.check_output([
+        sys.executable, '-m', 'benchmarks.throughput', '--child',
+        server.url(''), case, encoding, str(size)
+    ])
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def key(case, encoding, size):
+    return '{} {} {}'.format(case, encoding, size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default=','.join(SIZES),
+                        help='comma-separated payload sizes, e.g. 1K,8M')
+    parser.add_argument('--cases', default=','.join(CASES))
+    parser.add_argument('--save', help='write results to this JSON file')
+    parser.add_argument('--compare', help='show change against saved results')
+    parser.add_argument('--child', nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        base_url, case, encoding, size = args.child
+        return child(base_url, case, encoding, int(size))
+
+    previous = {}
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    server = LocalServer(compress=True)
+    results = {}
+
+    print('{:<10} {:>6} {:>9} {:>6} {:>9} {:>9} {:>9} {:>9} {:>9}'.format(
+        'case', 'size', 'encoding', 'runs', 'req/s', 'p50 ms', 'p99 ms',
+        'peak MB', 'x payload'))
+
+    try:
+        for size_text in args.sizes.split(','):
+            size = parse_size(size_text)
+            warm_up(server, size)
+
+            for case in args.cases.split(','):
+                for encoding in ENCODINGS:
+                    if case == 'post' and encoding != 'identity':
+                        continue
+
+                    result = run_case(server, case, encoding, size)
+                    results[key(case, encoding, size)] = result
+                    line = '{:<10} {:>6} {:>9} {:>6} {:>9.1f} {:>9.2f} ' \
+                        '{:>9.2f} {:>9.1f} {:>9.1f}'.format(
+                            case, size_text, encoding, result['runs'],
+                            result['rps'], result['p50'], result['p99'],
+                            result['peak'] / 1048576.0,
+                            float(result['peak']) / size)
+
+                    old = previous.get(key(case, encoding, size))
+
+                    if old:
+                        line += '   req/s {:+.0%}  p99 {:+.0%}'.format(
+                            result['rps'] / old['rps'] - 1,
+                            result['p99'] / old['p99'] - 1)
+
+                    print(line)
+                    sys.stdout.flush()
+    finally:
+        server.stop()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
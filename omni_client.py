@@ -0,0 +1,103 @@
+"""
+Entry point for Alfred's script filters.
+
+Forwards the invocation to a running ``alfred_omni_api.py daemon`` and
+prints its response. If no daemon accepts the connection, runs the command
+in this process instead, exactly as ``alfred_omni_api.py`` would. Once the
+request has been sent, the daemon is running it, so it is never run again
+here: if no answer comes, that is reported as an error.
+
+This speaks the wire format of ``workflow.daemon`` directly rather than
+importing it: the ``workflow`` package more than doubles the number of
+modules loaded, which is the start-up cost the daemon exists to avoid.
+"""
+import os
+import sys
+import json
+import errno
+import socket
+
+SOCKET_PATH = os.path.join(
+    os.environ.get('TMPDIR', '/tmp'),
+    'alfred-omni-api.{}.sock'.format(os.getuid())
+)
+
+# Seconds to wait for the daemon to accept before running the command here
+CONNECT_TIMEOUT = 1
+
+# Seconds to wait for the daemon's answer before giving up on it
+TIMEOUT = 60
+
+
+class DaemonError(Exception):
+    pass
+
+
+def call(argv):
+    """
+    Run `argv` on the daemon.
+
+    Returns `(status, output)`, or None if no daemon accepted the request.
+    Raises DaemonError if the daemon took the request but didn't answer.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    chunks = []
+
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+
+        try:
+            sock.connect(SOCKET_PATH)
+        except socket.timeout:  # daemon isn't accepting
+            return None
+        except socket.error as err:
+            if err.errno in (errno.ENOENT, errno.ECONNREFUSED):
+                return None
+            raise
+
+        sock.settimeout(TIMEOUT)
+
+        try:
+            sock.sendall(json.dumps({'argv': argv}) + '\n')
+
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                if '\n' in chunk:
+                    break
+        except socket.timeout:
+            raise DaemonError('No answer from daemon after {}s'.format(
+                TIMEOUT))
+        except socket.error as err:
+            raise DaemonError('Lost daemon: {}'.format(err))
+    finally:
+        sock.close()
+
+    response = ''.join(chunks).split('\n', 1)[0]
+    if not response:
+        raise DaemonError('Daemon closed the connection without answering')
+    data = json.loads(response)
+    return (data['status'], data['output'].encode('utf-8'))
+
+
+def main():
+    try:
+        result = call(sys.argv[1:])
+    except DaemonError as err:
+        sys.stderr.write('{}\n'.format(err))
+        sys.exit(1)
+
+    if result is None:
+        import alfred_omni_api
+        return alfred_omni_api.cli()
+
+    status, output = result
+    sys.stdout.write(output)
+    sys.stdout.flush()
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
@@ -53,6 +53,22 @@ relevant webservice, and call it from your main workflow script:
         wf = Workflow()
         wf.run(main)
 
+Tasks are queued in the workflow's cache directory and run by a small pool
+of worker processes (at most :const:`MAX_WORKERS`), which is only started
+when no worker is alive and exits after :const:`WORKER_IDLE` idle seconds.
+Queueing a task whose name is already queued doesn't add a second job: the
+queued job takes the newer arguments and keeps its place in line. Jobs with
+a higher ``priority`` run first:
+
+.. code-block:: python
+
+    run_in_background('update', cmd, priority=PRIORITY_HIGH)
+
+A running task holds a lock on a file named after it for as long as its
+worker runs it, so no two workers run the same task and a crashed worker
+can't leave a task marked as running. A task that goes ``timeout`` seconds
+without calling :func:`heartbeat` is considered stuck, killed, and may be
+queued again.
 
 For a working example, see :ref:`Part 2 of the tutorial <tutorial2>`.
 
@@ -62,83 +78,591 @@ from __future__ import print_function, unicode_literals
 
 import sys
 import os
+import time
+import fcntl
+import signal
 import subprocess
 import pickle
 
 from workflow import Workflow
 
-__all__ = ['is_running', 'run_in_background']
+__all__ = ['is_running', 'run_in_background', 'heartbeat',
+           'PRIORITY_LOW', 'PRIORITY_NORMAL', 'PRIORITY_HIGH']
+
+# Job priorities. Jobs with higher priority run first.
+PRIORITY_LOW = -10
+PRIORITY_NORMAL = 0
+PRIORITY_HIGH = 10
+
+# Most worker processes running queued jobs at once
+MAX_WORKERS = 2
+
+# Seconds a worker waits for new jobs before exiting
+WORKER_IDLE = 10
+
+# Seconds between an idle worker's checks of the queue, and between a busy
+# worker's checks of its task
+POLL_INTERVAL = 0.25
+
+# Seconds a task may go without a heartbeat before it's considered stuck
+TASK_TIMEOUT = 300
+
+# Seconds a stuck task has to exit after SIGTERM before it gets SIGKILL
+KILL_GRACE = 5
+
+# Seconds past its timeout after which a stuck task's worker is assumed
+# to be wedged too, and is killed by whoever queues the task next
+STUCK_GRACE = 30
+
+# Seconds to keep trying for a lock that only :func:`_locked` probes hold
+PROBE_WAIT = 0.1
+
+# Environment variable naming the task a process is running for
+TASK_ENV = 'WORKFLOW_BACKGROUND_TASK'
 
 wf = Workflow()
 log = wf.logger
 
 
-def _arg_cache(name):
-    """Return path to pickle cache file for arguments
+def _spool(state):
+    """Return path to directory holding jobs in ``state``
+
+    Jobs wait in ``queue`` and are moved to ``running`` by the worker that
+    claims them. Workers hold locks on slot files in ``workers``.
+
+    :param state: ``queue``, ``running`` or ``workers``
+    :type state: ``unicode``
+    :returns: Path to directory, which is created if need be
+    :rtype: ``unicode`` dirpath
+
+    """
+
+    dirpath = wf.cachefile(os.path.join('background', state))
+    if not os.path.exists(dirpath):
+        try:
+            os.makedirs(dirpath, 0o700)
+        except OSError:  # created by another process meanwhile
+            if not os.path.isdir(dirpath):
+                raise
+    return dirpath
+
+
+def _job_file(name, state):
+    """Return path to job file for task ``name`` in ``state``
 
     :param name: name of task
     :type name: ``unicode``
-    :returns: Path to cache file
+    :param state: ``queue`` or ``running``
+    :type state: ``unicode``
+    :returns: Path to job file
     :rtype: ``unicode`` filepath
 
     """
 
-    return wf.cachefile('{}.argcache'.format(name))
+    return os.path.join(_spool(state), '{}.job'.format(name))
 
 
-def _pid_file(name):
-    """Return path to PID file for ``name``
+def _lock_file(name):
+    """Return path to the file locked while task ``name`` runs
 
     :param name: name of task
     :type name: ``unicode``
-    :returns: Path to PID file for task
+    :returns: Path to lock file
     :rtype: ``unicode`` filepath
 
     """
 
-    return wf.cachefile('{}.pid'.format(name))
+    return os.path.join(_spool('running'), '{}.lock'.format(name))
+
+
+def _lock(path):
+    """Take an exclusive lock on ``path`` without waiting
+
+    The lock is held until the returned descriptor is closed or the process
+    exits, however it exits. Lock files are never deleted, as a process
+    could lock the deleted file while another locks its replacement.
+
+    Only :func:`_locked` takes these locks shared, and only for a moment,
+    so while the lock can still be had shared, it is retried for up to
+    :const:`PROBE_WAIT` seconds rather than reported as taken.
+
+    :returns: file descriptor holding the lock or ``None`` if another
+        process holds it
+    :rtype: ``int``
+
+    """
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    give_up = time.time() + PROBE_WAIT
+    while True:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd
+        except IOError:
+            pass
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except IOError:  # held exclusively: taken
+            break
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        if time.time() >= give_up:
+            break
+        time.sleep(0.005)
 
+    os.close(fd)
+    return None
 
-def _process_exists(pid):
-    """Check if a process with PID ``pid`` exists
 
-    :param pid: PID to check
-    :type pid: ``int``
-    :returns: ``True`` if process exists, else ``False``
+def _locked(path):
+    """Test whether another process holds a lock on ``path``
+
     :rtype: ``Boolean``
+
     """
 
     try:
-        os.kill(pid, 0)
-    except OSError:  # not running
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:  # never locked
         return False
-    return True
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except IOError:
+        return True
+    finally:
+        os.close(fd)
+    return False
+
+
+def _read_job(path):
+    """Load job from ``path``
+
+    Unpickling runs code, so files that anyone but the current user could
+    have written are ignored.
+
+    :returns: job ``dict`` or ``None`` if there is no (complete, trusted)
+        job file
+    :rtype: ``dict``
+
+    """
+
+    try:
+        with open(path, 'rb') as file:
+            st = os.fstat(file.fileno())
+            if st.st_uid != os.getuid() or st.st_mode & 0o022:
+                log.warning('Ignoring unsafe job file : {!r}'.format(path))
+                return None
+            return pickle.load(file)
+    except (IOError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def _write_job(path, job):
+    """Atomically save ``job`` to ``path``"""
+
+    # Jobs are unpickled by other processes, so only we may write them
+    tmp = '{}.{}'.format(path, os.getpid())
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as file:
+        pickle.dump(job, file)
+    os.rename(tmp, path)
+
+
+def _unlink(path):
+    """Delete ``path`` if it exists"""
+
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _stale(path, timeout):
+    """Test whether ``path`` was last modified over ``timeout`` seconds ago
+
+    :rtype: ``Boolean``
+
+    """
+
+    try:
+        return time.time() - os.stat(path).st_mtime > timeout
+    except OSError:
+        return False
+
+
+def _queued():
+    """Return jobs waiting in the queue, most urgent first
+
+    :rtype: ``list`` of ``dict``
+
+    """
+
+    dirpath = _spool('queue')
+    jobs = []
+    for filename in os.listdir(dirpath):
+        if filename.endswith('.job'):
+            job = _read_job(os.path.join(dirpath, filename))
+            if job:
+                jobs.append(job)
+    jobs.sort(key=lambda job: (-job['priority'], job['queued']))
+    return jobs
 
 
 def is_running(name):
     """
-    Test whether task is running under ``name``
+    Test whether task is queued or running under ``name``
+
+    :param name: name of task
+    :type name: ``unicode``
+    :returns: ``True`` if task with name ``name`` is queued or running,
+        else ``False``
+    :rtype: ``Boolean``
+
+    """
+
+    return (os.path.exists(_job_file(name, 'queue')) or
+            _locked(_lock_file(name)))
+
+
+def heartbeat(name=None):
+    """Tell the worker running task ``name`` that it is making progress
+
+    A task that goes ``timeout`` seconds (see :func:`run_in_background`)
+    without a heartbeat is considered stuck and killed. Long-running tasks
+    should call this every so often; tasks that never call it are killed
+    ``timeout`` seconds after they start.
+
+    :param name: name of task. Defaults to the task the current process
+        was started for.
+    :type name: ``unicode``
+
+    """
+
+    name = name or os.environ.get(TASK_ENV)
+    if not name:
+        return
+
+    try:
+        os.utime(_job_file(name, 'running'), None)
+    except OSError:  # not running
+        pass
+
+
+def _kill_stuck(name):
+    """Kill the worker of task ``name`` if it's stuck along with its task
+
+    A worker kills its own stuck tasks, so this is only needed when the
+    worker itself has stopped responding.
 
     :param name: name of task
     :type name: ``unicode``
-    :returns: ``True`` if task with name ``name`` is running, else ``False``
+    :returns: ``True`` if the worker was killed
     :rtype: ``Boolean``
 
     """
-    pidfile = _pid_file(name)
-    if not os.path.exists(pidfile):
+
+    path = _job_file(name, 'running')
+    job = _read_job(path)
+    if not job or 'worker' not in job:
         return False
 
-    with open(pidfile, 'rb') as file:
-        pid = int(file.read().strip())
+    if not _stale(path, job['timeout'] + STUCK_GRACE):
+        return False
 
-    if _process_exists(pid):
-        return True
+    # Only signal a process that holds one of our worker slots, not one
+    # that reused the PID of a worker that died meanwhile
+    worker = job['worker']
+    if worker not in _worker_pids():
+        log.warning('Task `{}` is stuck, but {} is not a worker'.format(
+                    name, worker))
+        return False
 
-    elif os.path.exists(pidfile):
-        os.unlink(pidfile)
+    log.warning('Task `{}` is stuck. Killing worker {}'.format(name, worker))
+    try:
+        group = os.getpgid(worker)
+        if group == os.getpgrp():
+            os.kill(worker, signal.SIGKILL)
+        else:  # the worker and its task
+            os.killpg(group, signal.SIGKILL)
+    except OSError:  # already gone
+        pass
+
+    # Wait for the kernel to release the lock
+    for _ in range(20):
+        if not _locked(_lock_file(name)):
+            break
+        time.sleep(0.05)
+    return True
 
-    return False
+
+def _slot_file(index):
+    """Return path to the file locked by the worker in slot ``index``
+
+    :param index: slot number, below :const:`MAX_WORKERS`
+    :type index: ``int``
+    :returns: Path to slot file
+    :rtype: ``unicode`` filepath
+
+    """
+
+    return os.path.join(_spool('workers'), '{}.lock'.format(index))
+
+
+def _workers_alive():
+    """Return number of running workers
+
+    :rtype: ``int``
+
+    """
+
+    return len([i for i in range(MAX_WORKERS) if _locked(_slot_file(i))])
+
+
+def _worker_pids():
+    """Return PIDs of running workers, as recorded in their slot files
+
+    :rtype: ``list`` of ``int``
+
+    """
+
+    pids = []
+    for i in range(MAX_WORKERS):
+        path = _slot_file(i)
+        if not _locked(path):
+            continue
+        try:
+            with open(path, 'rb') as file:
+                st = os.fstat(file.fileno())
+                if st.st_uid == os.getuid() and not st.st_mode & 0o022:
+                    pids.append(int(file.read()))
+        except (IOError, ValueError):  # gone or not registered yet
+            pass
+    return pids
+
+
+def _acquire_slot():
+    """Lock a free worker slot
+
+    :returns: file descriptor holding the slot or ``None`` if the pool is
+        full
+    :rtype: ``int``
+
+    """
+
+    for i in range(MAX_WORKERS):
+        fd = _lock(_slot_file(i))
+        if fd is not None:
+            return fd
+    return None
+
+
+def _register(slot):
+    """Record the PID of the current process in the slot it holds
+
+    :param slot: file descriptor holding the slot
+    :type slot: ``int``
+
+    """
+
+    os.ftruncate(slot, 0)
+    os.lseek(slot, 0, os.SEEK_SET)
+    os.write(slot, b'%d' % os.getpid())
+
+
+def _start_worker():
+    """Start a worker process, which forks into the background
+
+    :returns: exit code of launching process
+    :rtype: ``int``
+
+    """
+
+    # Run as a module from the directory containing the `workflow`
+    # package, so its relative imports work
+    cmd = [sys.executable, '-m', 'workflow.background', '--worker']
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    log.debug('Calling {!r} ...'.format(cmd))
+    # Don't pass on locks held by a worker starting a sibling
+    retcode = subprocess.call(cmd, cwd=cwd, close_fds=True)
+    if retcode:  # pragma: no cover
+        log.error('Failed to start background worker')
+    return retcode
+
+
+def run_in_background(name, args, priority=PRIORITY_NORMAL,
+                      timeout=TASK_TIMEOUT, **kwargs):
+    """Queue a task to be run by :meth:`subprocess.call` in a background
+    worker, starting a worker if none is alive.
+
+    If task ``name`` is already queued, its job is updated with ``args``,
+    ``kwargs`` and the higher of the two priorities instead of queueing it
+    twice. If it is running, nothing is queued, unless it is stuck.
+
+    :param name: name of task
+    :type name: ``unicode``
+    :param args: arguments passed as first argument to :meth:`subprocess.call`
+    :param priority: jobs with higher priority run first
+    :type priority: ``int``
+    :param timeout: seconds the task may go without a :func:`heartbeat`
+        before it is killed
+    :type timeout: ``int``
+    :param *kwargs: keyword arguments to :meth:`subprocess.call`
+    :returns: exit code of process starting the worker, ``0`` if a worker
+        was already running, or ``None`` if the task is running
+    :rtype: ``int``
+
+    """
+
+    if _locked(_lock_file(name)) and not _kill_stuck(name):
+        log.info('Task `{}` is already running'.format(name))
+        return
+
+    path = _job_file(name, 'queue')
+    job = {'name': name, 'args': args, 'kwargs': kwargs,
+           'priority': priority, 'timeout': timeout, 'queued': time.time()}
+
+    queued = _read_job(path)
+    if queued:  # coalesce with the queued job, which keeps its place
+        log.debug('Task `{}` is already queued'.format(name))
+        job['priority'] = max(priority, queued['priority'])
+        job['queued'] = queued['queued']
+
+    _write_job(path, job)
+
+    if _workers_alive():
+        return 0
+
+    return _start_worker()
+
+
+def _claim():
+    """Lock the most urgent queued job's task and move the job to
+    ``running``
+
+    :returns: ``(job, lock)`` or ``(None, None)`` if there's nothing to run
+    :rtype: ``tuple``
+
+    """
+
+    for job in _queued():
+        name = job['name']
+        lock = _lock(_lock_file(name))
+        if lock is None:  # running elsewhere; run again once it's finished
+            continue
+
+        running = _job_file(name, 'running')
+        try:
+            os.rename(_job_file(name, 'queue'), running)
+        except OSError:  # already run by another worker
+            os.close(lock)
+            continue
+
+        # Re-read, as the job may have been coalesced since it was listed
+        job = _read_job(running) or job
+        job['worker'] = os.getpid()
+        _write_job(running, job)
+        return job, lock
+
+    return None, None
+
+
+def _terminate(process):
+    """Stop ``process``, by force if it ignores SIGTERM"""
+
+    process.terminate()
+    deadline = time.time() + KILL_GRACE
+    while process.poll() is None and time.time() < deadline:
+        time.sleep(POLL_INTERVAL)
+    if process.poll() is None:
+        process.kill()
+
+
+def _run(job, lock):
+    """Run ``job``, killing it if it stops sending heartbeats, then remove
+    it from ``running`` and release its ``lock``
+
+    """
+
+    name = job['name']
+    args = job['args']
+    kwargs = job['kwargs']
+    running = _job_file(name, 'running')
+
+    try:
+        log.debug('Task `{}` running'.format(name))
+        log.debug('cmd : {!r}'.format(args))
+
+        # Let workflow.web leave rate limit headroom to interactive requests
+        env = dict(kwargs.pop('env', None) or os.environ)
+        env.setdefault('WORKFLOW_WEB_PRIORITY', 'background')
+        env[TASK_ENV] = name
+
+        # Keep the task from inheriting, and outliving us with, our locks
+        kwargs.setdefault('close_fds', True)
+
+        process = subprocess.Popen(args, env=env, **kwargs)
+        os.utime(running, None)  # first heartbeat
+
+        while process.poll() is None:
+            if _stale(running, job['timeout']):
+                log.error('Task `{}` sent no heartbeat for {} seconds. '
+                          'Killing it'.format(name, job['timeout']))
+                _terminate(process)
+                break
+            time.sleep(POLL_INTERVAL)
+
+        retcode = process.wait()
+
+        if retcode:
+            log.error('Command failed with [{}] : {!r}'.format(retcode, args))
+
+    except Exception as err:
+        log.exception('Task `{}` failed : {}'.format(name, err))
+
+    finally:
+        _unlink(running)
+        os.close(lock)
+        log.debug('Task `{}` finished'.format(name))
+
+
+def _work(slot):
+    """Run queued jobs until the queue has been empty for
+    :const:`WORKER_IDLE` seconds
+
+    :param slot: file descriptor holding this worker's slot
+    :type slot: ``int``
+
+    """
+
+    try:
+        _register(slot)
+        idle_since = time.time()
+        while True:
+            job, lock = _claim()
+            if job:
+                if _queued() and _workers_alive() < MAX_WORKERS:
+                    _start_worker()
+                _run(job, lock)
+                idle_since = time.time()
+
+            elif time.time() - idle_since < WORKER_IDLE:
+                time.sleep(POLL_INTERVAL)
+
+            else:
+                # Give up the slot before the last look at the queue, so a
+                # job queued meanwhile is seen here or starts a new worker
+                os.close(slot)
+                slot = None
+                if not _queued():
+                    break
+                slot = _acquire_slot()
+                if slot is None:  # another worker took over
+                    break
+                _register(slot)
+
+    finally:
+        if slot is not None:
+            os.close(slot)
 
 
 def _background(stdin='/dev/null', stdout='/dev/null',
@@ -164,7 +688,7 @@ def _background(stdin='/dev/null', stdout='/dev/null',
         sys.exit(1)
     # Decouple from parent environment.
     os.chdir(wf.workflowdir)
-    os.umask(0)
+    os.umask(0o077)
     os.setsid()
     # Do second fork.
     try:
@@ -187,87 +711,23 @@ def _background(stdin='/dev/null', stdout='/dev/null',
         os.dup2(se.fileno(), sys.stderr.fileno())
 
 
-def run_in_background(name, args, **kwargs):
-    """Pickle arguments to cache file, then call this script again via
-    :meth:`subprocess.call`.
-
-    :param name: name of task
-    :type name: ``unicode``
-    :param args: arguments passed as first argument to :meth:`subprocess.call`
-    :param *kwargs: keyword arguments to :meth:`subprocess.call`
-    :returns: exit code of sub-process
-    :rtype: ``int``
-
-    """
-
-    if is_running(name):
-        log.info('Task `{}` is already running'.format(name))
-        return
-
-    argcache = _arg_cache(name)
-
-    # Cache arguments
-    with open(argcache, 'wb') as file:
-        pickle.dump({'args': args, 'kwargs': kwargs}, file)
-
-    # Call this script
-    cmd = ['/usr/bin/python', __file__, name]
-    log.debug('Calling {!r} ...'.format(cmd))
-    retcode = subprocess.call(cmd)
-    if retcode:  # pragma: no cover
-        log.error('Failed to call task in background')
-    else:
-        log.debug('Executing task `{}` in background...'.format(name))
-    return retcode
-
-
 def main(wf):  # pragma: no cover
     """
-    Load cached arguments, fork into background, then call
-    :meth:`subprocess.call` with cached arguments
+    Take a worker slot, fork into background, then run queued jobs
 
     """
 
-    name = wf.args[0]
-    argcache = _arg_cache(name)
-    if not os.path.exists(argcache):
-        log.critical('No arg cache found : {!r}'.format(argcache))
-        return 1
-
-    # Load cached arguments
-    with open(argcache, 'rb') as file:
-        data = pickle.load(file)
-
-    # Cached arguments
-    args = data['args']
-    kwargs = data['kwargs']
-
-    # Delete argument cache file
-    os.unlink(argcache)
-
-    pidfile = _pid_file(name)
+    # Take the slot before forking, so the worker is never invisible to
+    # `run_in_background`. The forked daemon inherits the lock.
+    slot = _acquire_slot()
+    if slot is None:
+        log.debug('Worker pool is full')
+        return
 
-    # Fork to background
     _background()
-
-    # Write PID to file
-    with open(pidfile, 'wb') as file:
-        file.write('{}'.format(os.getpid()))
-
-    # Run the command
-    try:
-        log.debug('Task `{}` running'.format(name))
-        log.debug('cmd : {!r}'.format(args))
-
-        retcode = subprocess.call(args, **kwargs)
-
-        if retcode:
-            log.error('Command failed with [{}] : {!r}'.format(retcode, args))
-
-    finally:
-        if os.path.exists(pidfile):
-            os.unlink(pidfile)
-        log.debug('Task `{}` finished'.format(name))
+    log.debug('Worker {} started'.format(os.getpid()))
+    _work(slot)
+    log.debug('Worker {} exiting'.format(os.getpid()))
 
 
 if __name__ == '__main__':  # pragma: no cover
@@ -0,0 +1,223 @@
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""
+Serve script-filter invocations from a long-lived process.
+
+Every keystroke in Alfred normally starts a fresh Python interpreter, which
+then pays for imports, ``info.plist`` parsing, Keychain lookups and cache
+unpickling before it can do any real work. :func:`serve` keeps a single
+process alive instead, listening on a Unix domain socket. A client sends
+the argument vector for one invocation, the server runs it in-process and
+sends back whatever was written to ``stdout`` along with the exit status.
+
+:func:`serve` is only the server half. A client should import as little as
+possible, since start-up time is what the daemon is there to save, so it
+speaks the wire format itself (see ``omni_client.py``). The format is one
+line of JSON in each direction: ``{"argv": [...]}`` from the client and
+``{"status": 0, "output": "..."}`` from the server. A client that can't
+connect should run the invocation itself; once it has sent the request,
+the server is running it and the client must not.
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import socket
+import logging
+import threading
+import cStringIO
+
+log = logging.getLogger('workflow')
+
+# Stop serving after this many seconds without a request
+IDLE_TIMEOUT = 60 * 10
+
+
+def _recv_line(sock):
+    """Read from ``sock`` until newline or EOF.
+
+    :param sock: connected socket
+    :type sock: :class:`socket.socket`
+    :returns: the line without its trailing newline
+    :rtype: ``str``
+
+    """
+
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        if '\n' in chunk:
+            chunks.append(chunk[:chunk.index('\n')])
+            break
+        chunks.append(chunk)
+    return ''.join(chunks)
+
+
+class _ThreadOutput(object):
+    """Stand-in for ``sys.stdout`` that gives each thread its own buffer.
+
+    Output of a thread that has called :meth:`capture` goes to its buffer
+    until :meth:`release`; everything else goes to ``stream``.
+
+    :param stream: the real ``sys.stdout``
+
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+
+    def capture(self):
+        """Start sending this thread's output to a new buffer.
+
+        :returns: the buffer
+        :rtype: ``cStringIO.StringIO``
+
+        """
+
+        self._local.buf = cStringIO.StringIO()
+        return self._local.buf
+
+    def release(self):
+        """Send this thread's output to the real stream again."""
+        self._local.buf = None
+
+    def __getattr__(self, name):
+        buf = getattr(self._local, 'buf', None)
+        return getattr(self.stream if buf is None else buf, name)
+
+
+def _run(handler, argv, output):
+    """Call ``handler`` with ``argv``, capturing ``stdout`` and exit status.
+
+    :param output: the :class:`_ThreadOutput` installed as ``sys.stdout``
+    :returns: ``(status, output)``
+    :rtype: ``tuple``
+
+    """
+
+    buf = output.capture()
+    status = 0
+    try:
+        handler(argv)
+    except SystemExit as err:
+        if err.code is None:
+            status = 0
+        elif isinstance(err.code, int):
+            status = err.code
+        else:
+            print(err.code, file=sys.stderr)
+            status = 1
+    except Exception as err:
+        log.exception(err)
+        status = 1
+    finally:
+        output.release()
+    return (status, buf.getvalue())
+
+
+def _answer(conn, handler, output):
+    """Read one request from ``conn``, run it and send the response."""
+    try:
+        conn.settimeout(None)
+        request = json.loads(_recv_line(conn))
+        # Hand over encoded args, as they would be in ``sys.argv``
+        argv = [arg.encode('utf-8') for arg in request['argv']]
+        status, text = _run(handler, argv, output)
+        response = {'status': status,
+                    'output': text.decode('utf-8', 'replace')}
+        conn.sendall(json.dumps(response) + '\n')
+    except Exception as err:
+        log.exception(err)
+    finally:
+        conn.close()
+
+
+def _listen(path):
+    """Bind a listening socket at ``path``, replacing any stale socket.
+
+    :returns: listening socket or ``None`` if a server is already running
+    :rtype: :class:`socket.socket`
+
+    """
+
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except socket.error:  # stale socket left by a dead server
+            os.unlink(path)
+        else:
+            return None
+        finally:
+            probe.close()
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o077)  # only the current user may connect
+    try:
+        sock.bind(path)
+    finally:
+        os.umask(umask)
+    sock.listen(16)
+    return sock
+
+
+def serve(path, handler, idle_timeout=IDLE_TIMEOUT):
+    """Answer requests on Unix socket ``path`` until idle for too long.
+
+    Each request is handled in its own thread, so a slow one doesn't hold
+    up the rest, and ``handler`` must be thread-safe. ``sys.stdout`` is
+    replaced for as long as the server runs, so that each thread's output
+    goes to its own client.
+
+    :param path: path of the Unix socket to create
+    :type path: ``str``
+    :param handler: callable run with the ``argv`` list of each request.
+        Anything it writes to ``sys.stdout`` is returned to the client,
+        and :class:`SystemExit` sets the exit status.
+    :type handler: ``callable``
+    :param idle_timeout: exit after this many seconds without a request
+    :type idle_timeout: ``int``
+    :returns: ``False`` if another server is already listening at ``path``
+    :rtype: ``Boolean``
+
+    """
+
+    sock = _listen(path)
+    if sock is None:
+        log.info('Server already running at %s', path)
+        return False
+
+    sock.settimeout(idle_timeout)
+    stdout = sys.stdout
+    sys.stdout = output = _ThreadOutput(stdout)
+    threads = []
+    log.debug('Serving at %s', path)
+    try:
+        while True:
+            try:
+                conn, _ = sock.accept()
+            except socket.timeout:
+                log.debug('Idle for %ds, shutting down', idle_timeout)
+                break
+            thread = threading.Thread(target=_answer,
+                                      args=(conn, handler, output))
+            thread.start()
+            threads = [t for t in threads if t.is_alive()] + [thread]
+    finally:
+        sock.close()
+        if os.path.exists(path):
+            os.unlink(path)
+        # Requests in progress still write to their buffers
+        for thread in threads:
+            thread.join()
+        sys.stdout = stdout
+    return True
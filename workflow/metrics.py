@@ -0,0 +1,325 @@
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""
+Per-phase timings for workflow runs.
+
+Set the environment variable ``WORKFLOW_METRICS=1`` to record how long each
+phase of a run takes (imports, Keychain, cache loads, network, filtering,
+rendering...). One JSON record per run is appended to ``metrics.jsonl`` in
+the workflow's cache directory, which is trimmed once it grows past
+:const:`MAX_BYTES`.
+
+Phases are timed with a monotonic clock where the platform has one (see
+:func:`_monotonic_clock`), so setting the system clock doesn't skew them.
+
+When metrics are disabled, :func:`phase` returns a shared no-op context
+manager and :func:`timed` returns the decorated function unchanged.
+
+.. code-block:: python
+
+    from workflow import metrics
+
+    metrics.set_label('MyHandler')
+
+    with metrics.phase('network'):
+        r = web.get(url)
+
+To summarise the recorded runs, with p50/p95 milliseconds per phase::
+
+    python -m workflow.metrics
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import threading
+
+ENABLED = os.environ.get('WORKFLOW_METRICS', '') not in ('', '0')
+
+# Name of the metrics file in the workflow's cache directory
+METRICS_FILE = 'metrics.jsonl'
+
+# Once the metrics file reaches this size, only its newer half is kept
+MAX_BYTES = 512 * 1024
+
+
+
+def _monotonic_clock():
+    """Return a clock that never goes backwards, in seconds.
+
+    Python 2 has no ``time.monotonic``, so ``clock_gettime`` is called
+    through :mod:`ctypes`. Falls back to ``time.time``, which jumps when the
+    system clock is set, where that isn't available (e.g. macOS < 10.12).
+
+    """
+
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+
+    try:
+        import ctypes
+        import ctypes.util
+
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        clock_gettime = None
+        for name in ('c', 'rt'):
+            path = ctypes.util.find_library(name)
+            lib = ctypes.CDLL(path) if path else None
+            clock_gettime = getattr(lib, 'clock_gettime', None)
+            if clock_gettime:
+                break
+        if not clock_gettime:
+            return time.time
+    except (ImportError, OSError):
+        return time.time
+
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    # CLOCK_MONOTONIC
+    clock_id = 6 if sys.platform == 'darwin' else 1
+    if clock_gettime(clock_id, ctypes.byref(timespec())):
+        return time.time
+
+    def monotonic():
+        ts = timespec()
+        clock_gettime(clock_id, ctypes.byref(ts))
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+
+    return monotonic
+
+
+# Only pay for loading ctypes when timings are recorded
+_clock = _monotonic_clock() if ENABLED else time.time
+
+
+class _Run(threading.local):
+    """Start, label and phases of the current thread's run, so threads
+    of a server that handles runs concurrently (see :mod:`workflow.daemon`)
+    don't mix up their timings."""
+
+    def __init__(self):
+        self.started = _clock()
+        self.label = None
+        self.phases = {}
+
+
+_run = _Run()
+
+# Set by start(): runs are delimited explicitly and the process's exit
+# isn't a run of its own
+_explicit = False
+
+
+class _NullPhase(object):
+    """Stand-in for :class:`_Phase` when metrics are disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase(object):
+    """Add the time spent inside the ``with`` block to phase ``name``."""
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = _clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = _clock() - self.start
+        _run.phases[self.name] = _run.phases.get(self.name, 0.0) + elapsed
+        return False
+
+
+def phase(name):
+    """Return a context manager that times its block as phase ``name``.
+
+    Time spent in the same phase several times during a run is summed.
+
+    :param name: name of phase
+    :type name: ``str``
+
+    """
+
+    if not ENABLED:
+        return _NULL_PHASE
+    return _Phase(name)
+
+
+def timed(name):
+    """Decorator version of :func:`phase`.
+
+    :param name: name of phase
+    :type name: ``str``
+
+    """
+
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Phase(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def set_label(label):
+    """Set the name under which the current run is recorded.
+
+    :param label: e.g. the name of the handler
+    :type label: ``str``
+
+    """
+
+    _run.label = label
+
+
+def start():
+    """Begin a new run, discarding anything recorded since the last flush.
+
+    For long-running processes that handle several runs: call it when
+    each run begins and :func:`flush` when it ends, so idle time between
+    runs isn't counted. Once it has been called, no record is written
+    when the process exits.
+
+    """
+
+    global _explicit
+
+    _explicit = True
+    _run.started, _run.label, _run.phases = _clock(), None, {}
+
+
+def metrics_path():
+    """Return path to the metrics file."""
+    from workflow import Workflow
+    return Workflow().cachefile(METRICS_FILE)
+
+
+def _trim(path):
+    """Keep only the newer half of the metrics file at ``path``."""
+    with open(path, 'rb') as file:
+        lines = file.readlines()
+    tmp = '%s.%d' % (path, os.getpid())
+    with open(tmp, 'wb') as file:
+        file.writelines(lines[len(lines) // 2:])
+    os.rename(tmp, path)
+
+
+def flush():
+    """Append a record of the current run and start a new one.
+
+    Called automatically at exit, unless :func:`start` has been called.
+    Long-running processes that handle several runs should call
+    :func:`start` before and this after each.
+
+    """
+
+    if not ENABLED:
+        return
+
+    now = _clock()
+    record = {
+        'time': time.time(),
+        'label': _run.label or os.path.basename(sys.argv[0]),
+        'total': round((now - _run.started) * 1000, 2),
+        'phases': dict((k, round(v * 1000, 2))
+                       for k, v in _run.phases.items()),
+    }
+    _run.started, _run.label, _run.phases = now, None, {}
+
+    path = metrics_path()
+    with open(path, 'ab') as file:
+        file.write(json.dumps(record, sort_keys=True) + '\n')
+    if os.path.getsize(path) > MAX_BYTES:
+        _trim(path)
+
+
+def _percentile(values, pct):
+    """Return the ``pct`` percentile (nearest-rank) of sorted ``values``."""
+    index = int(round(pct / 100.0 * len(values) + 0.5)) - 1
+    return values[max(0, min(index, len(values) - 1))]
+
+
+def summary(path=None):
+    """Summarise recorded runs per label and phase.
+
+    :param path: metrics file; defaults to :func:`metrics_path`
+    :returns: ``{label: {phase: (count, p50, p95)}}`` in milliseconds.
+        The whole run is reported as phase ``total``.
+    :rtype: ``dict``
+
+    """
+
+    samples = {}
+    with open(path or metrics_path(), 'rb') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:  # partially written line
+                continue
+            phases = samples.setdefault(record['label'], {})
+            phases.setdefault('total', []).append(record['total'])
+            for name, value in record['phases'].items():
+                phases.setdefault(name, []).append(value)
+
+    result = {}
+    for label, phases in samples.items():
+        result[label] = {}
+        for name, values in phases.items():
+            values.sort()
+            result[label][name] = (len(values), _percentile(values, 50),
+                                   _percentile(values, 95))
+    return result
+
+
+def main(args):  # pragma: no cover
+    """Print the table returned by :func:`summary`."""
+    path = args[0] if args else None
+    for label, phases in sorted(summary(path).items()):
+        print(label)
+        for name, (count, p50, p95) in sorted(phases.items()):
+            print('    {0:<16} n={1:<6} p50={2:>9.1f}ms '
+                  'p95={3:>9.1f}ms'.format(name, count, p50, p95))
+
+
+def _flush_at_exit():
+    """Record the process as a run, unless runs are delimited by
+    :func:`start` and :func:`flush`.
+
+    """
+
+    if not _explicit:
+        flush()
+
+
+if ENABLED and __name__ != '__main__':
+    atexit.register(_flush_at_exit)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main(sys.argv[1:])
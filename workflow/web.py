@@ -19,6 +19,19 @@ Features:
 - Form data submission
 - File uploads
 - Redirection support
+- Persistent, per-host connections via :class:`Session`
+- Transparent gzip/deflate decompression
+- HTTP caching (``Cache-Control``, ``Expires``, ``ETag``...) via
+  :class:`HTTPCache`
+- Concurrent requests via :func:`fetch_many`, or :func:`submit` and
+  :class:`Future`
+- Streaming responses and incremental JSON parsing
+- Paginated APIs via :func:`paginate`
+- Rate limiting learned from response headers via :class:`RateLimiter`
+- Record/replay of responses for offline benchmarks via :class:`Cassette`
+- Failing fast on unreachable hosts via :class:`OfflineTracker`
+- Separate connect/read timeouts, a total ``deadline`` per call and retries
+  with jittered exponential backoff
 
 **WARNING**: As ``web.py`` is based on Python 2's standard HTTP libraries, it
 **does not** verify SSL certificates when establishing HTTPS connections.
@@ -36,17 +49,119 @@ from __future__ import print_function
 
 import urllib
 import urllib2
+import urlparse
+import httplib
 import socket
+import errno
+import select
+import base64
+import cStringIO
+import Queue
+import threading
 import mimetypes
 import string
 import random
+import os
+import time
+import fcntl
 import json
 import re
+import zlib
+import pickle
+import hashlib
+import logging
+import email.utils
+from contextlib import contextmanager
 import unicodedata
 
+from . import metrics
+
+log = logging.getLogger('workflow')
+
 
 USER_AGENT = u'alfred-workflow-0.1'
 
+# Sent by default so servers may compress responses
+ACCEPT_ENCODING = 'gzip, deflate'
+
+# Idle keep-alive connections kept per host by a :class:`Session`
+MAX_IDLE_CONNECTIONS = 4
+
+# Concurrent requests per host allowed by a :class:`Session`
+MAX_PER_HOST = 4
+
+# Worker threads used by :func:`submit` and :func:`fetch_many`
+MAX_WORKERS = 8
+
+# Request priorities understood by :class:`RateLimiter`. Background
+# requests leave part of each host's budget to interactive ones.
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_BACKGROUND = 'background'
+
+# Priority of requests that don't specify one. Set the environment variable
+# in processes doing background refreshes.
+DEFAULT_PRIORITY = os.environ.get('WORKFLOW_WEB_PRIORITY',
+                                  PRIORITY_INTERACTIVE)
+
+# Redirections followed by a single request
+MAX_REDIRECTS = 10
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+# Default ``(connect, read)`` timeouts in seconds. The read timeout applies
+# to each read from the socket, not to the whole response.
+TIMEOUT = (5, 30)
+
+# Seconds a call through the module-level functions may take in total,
+# retries and redirections included
+DEADLINE = 30
+
+# Times an idempotent request is retried after a connection error or one
+# of the responses in RETRY_CODES. A read timeout isn't retried: a server
+# that didn't answer in time is unlikely to do better at once.
+RETRIES = 2
+
+RETRY_CODES = (502, 503, 504)
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS', 'TRACE')
+
+# Retry ``n`` (from 0) waits a random time between zero and
+# ``min(BACKOFF_MAX, BACKOFF_FACTOR * 2 ** n)`` seconds ("full jitter"),
+# so clients that failed together don't retry together
+BACKOFF_FACTOR = 0.5
+BACKOFF_MAX = 10
+
+# Request headers, response headers and URL parameters whose values are
+# replaced with REDACTED when recorded by a :class:`Cassette`
+SCRUB_HEADERS = ('authorization', 'cookie', 'proxy-authorization',
+                 'set-cookie')
+SCRUB_PARAMS = ('access_token', 'api_key', 'apikey', 'key', 'password',
+                'secret', 'signature', 'token')
+REDACTED = 'REDACTED'
+
+# Seconds an unreachable host is failed without trying it again, and the
+# connect timeout of the probe made after that. See :class:`OfflineTracker`.
+OFFLINE_TTL = 10
+PROBE_TIMEOUT = 1
+
+# Seconds resolved addresses are kept by a :class:`DNSCache`
+DNS_TTL = 300
+
+# Default size limit of an :class:`HTTPCache` in bytes
+HTTP_CACHE_SIZE = 20 * 1024 * 1024
+
+# Seconds between attempts to lock an :class:`HTTPCache` entry
+CACHE_LOCK_POLL = 0.05
+
+# Only this much of an HTML or XML body is searched for a charset declaration
+SNIFF_BYTES = 4096
+
+_META_CHARSET = re.compile(r"""<meta[^>]+charset=["']?([\w.:-]+)""", re.I)
+_XML_ENCODING = re.compile(r"""<\?xml[^>]+encoding=["']([\w.:-]+)["']""")
+
+# Marks lazily computed attributes that haven't been computed yet
+_UNSET = object()
+
 # Valid characters for multipart form data boundaries
 BOUNDARY_CHARS = string.digits + string.ascii_letters
 
@@ -113,11 +228,223 @@ def str_dict(dic):
     return dic2
 
 
-class NoRedirectHandler(urllib2.HTTPRedirectHandler):
-    """Prevent redirections"""
+class DeflateDecoder(object):
+    """Decompress ``Content-Encoding: deflate`` data.
 
-    def redirect_request(self, req, fp, code, msg, hdrs, newurl):
-        return None
+    Some servers send zlib-wrapped data, as the spec requires, and others
+    raw deflate streams, so the first chunk decides which to expect.
+
+    """
+
+    def __init__(self):
+        self._first_try = True
+        self._data = ''
+        self._obj = zlib.decompressobj()
+
+    def decompress(self, data):
+        if not self._first_try:
+            return self._obj.decompress(data)
+
+        self._data += data
+        try:
+            decompressed = self._obj.decompress(data)
+        except zlib.error:
+            self._first_try = False
+            self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+            try:
+                return self.decompress(self._data)
+            finally:
+                self._data = None
+        if decompressed:
+            self._first_try = False
+            self._data = None
+        return decompressed
+
+    def flush(self):
+        return self._obj.flush()
+
+
+def get_decoder(content_encoding):
+    """Return a decompressor for ``content_encoding`` or ``None``.
+
+    :param content_encoding: value of ``Content-Encoding`` header
+    :type content_encoding: ``str``
+    :returns: object with ``decompress(data)`` and ``flush()`` methods
+
+    """
+
+    content_encoding = (content_encoding or '').strip().lower()
+    if content_encoding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif content_encoding == 'deflate':
+        return DeflateDecoder()
+    return None
+
+
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+# What may follow a number up to the end of the buffer if the number
+# continues in the next chunk, e.g. ``1.`` or ``12e``
+_number_tail = re.compile(r'[0-9.eE+-]*\Z')
+
+
+class _JSONStream(object):
+    """Pull JSON values one at a time from an iterator of ``str`` chunks."""
+
+    def __init__(self, chunks, encoding):
+        self._chunks = iter(chunks)
+        self._decoder = json.JSONDecoder(encoding)
+        self._buf = ''
+        self._pos = 0
+
+    def _more(self):
+        """Append the next chunk to the buffer. Return ``False`` at EOF."""
+        for chunk in self._chunks:
+            self._buf = self._buf[self._pos:] + chunk
+            self._pos = 0
+            return True
+        return False
+
+    def peek(self):
+        """Return next non-whitespace character or ``None`` at EOF."""
+        while True:
+            self._pos = _whitespace.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._more():
+                return None
+
+    def take(self, char):
+        """Consume ``char`` or raise :class:`ValueError`."""
+        if self.peek() != char:
+            raise ValueError('Expected %r at %r' % (
+                char, self._buf[self._pos:self._pos + 20]))
+        self._pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except ValueError:
+                if not self._more():
+                    raise
+                continue
+            # A number followed by nothing but number characters up to the
+            # end of the buffer may continue in the next chunk
+            if (isinstance(value, (int, long, float)) and
+                    not isinstance(value, bool) and
+                    _number_tail.match(self._buf, end) and self._more()):
+                continue
+            self._pos = end
+            return value
+
+
+def iter_json_items(chunks, key=None, encoding='utf-8'):
+    """Yield the elements of a JSON array as its text arrives.
+
+    Only one element at a time is held in memory (plus the current chunk),
+    so large API responses can be processed while still downloading.
+
+    :param chunks: iterable of ``str``, e.g. :meth:`Response.iter_content`
+    :param key: if the document is an object, the key of the array to
+        iterate over. Other members are skipped.
+    :type key: ``unicode``
+    :param encoding: encoding of the JSON text
+    :type encoding: ``str``
+    :returns: iterator of decoded elements
+
+    """
+
+    stream = _JSONStream(chunks, encoding)
+
+    if key is not None:
+        stream.take('{')
+        while True:
+            if stream.peek() == '}':  # no such key
+                return
+            name = stream.value()
+            stream.take(':')
+            if name == key:
+                break
+            stream.value()
+            if stream.peek() == ',':
+                stream.take(',')
+
+    stream.take('[')
+    if stream.peek() == ']':
+        return
+    while True:
+        yield stream.value()
+        if stream.peek() == ']':
+            return
+        stream.take(',')
+
+
+class DeadlineExceeded(socket.timeout):
+    """Raised when a request's ``deadline`` passes before it completes.
+
+    A subclass of :class:`socket.timeout`, so code handling timeouts
+    handles this too.
+
+    """
+
+
+class Request(urllib2.Request):
+    """:class:`urllib2.Request` that remembers its HTTP method and the
+    per-request options passed to :meth:`Session.request`.
+
+    Available as :attr:`Response.request`.
+
+    """
+
+    def __init__(self, method, url, data=None, headers=None, timeout=TIMEOUT,
+                 stream=False, priority=None, deadline=None):
+        urllib2.Request.__init__(self, url, data, headers or {})
+        self.method = method
+        self.timeout = timeout
+        self.stream = stream
+        self.priority = priority or DEFAULT_PRIORITY
+        # Absolute time (``time.time()``) by which the call must finish
+        self.deadline = deadline
+        # ``(host, port)`` if the last attempt couldn't connect
+        self.unreachable = None
+
+    def get_method(self):
+        return self.method
+
+    def remaining(self):
+        """Return seconds left until :attr:`deadline` or ``None``.
+
+        :raises: :class:`DeadlineExceeded` if it has passed
+
+        """
+
+        if self.deadline is None:
+            return None
+        remaining = self.deadline - time.time()
+        if remaining <= 0:
+            raise DeadlineExceeded('deadline exceeded : %s' %
+                                   self.get_full_url())
+        return remaining
+
+    def timeouts(self):
+        """Return ``(connect, read)`` timeouts for the next attempt,
+        shortened so neither runs past :attr:`deadline`.
+
+        :raises: :class:`DeadlineExceeded` if the deadline has passed
+
+        """
+
+        timeout = self.timeout
+        if not isinstance(timeout, tuple):
+            timeout = (timeout, timeout)
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        return tuple(remaining if t is None else min(t, remaining)
+                     for t in timeout)
 
 
 class Response(object):
@@ -137,61 +464,206 @@ class Response(object):
     u'<html> ...'
     >>> r.json()  # content parsed as JSON
 
+    Bodies sent with ``Content-Encoding: gzip`` or ``deflate`` are
+    decompressed, so :attr:`content` is always the decoded payload.
+
+    If the request was made with ``stream=True``, the body is not read
+    until it is needed. Use :meth:`iter_content` or :meth:`iter_json` to
+    process it piece by piece without holding all of it in memory:
+
+    >>> r = get(url, stream=True)
+    >>> for issue in r.iter_json(key='issues'):
+    ...     print(issue['key'])
+
+    A streamed response holds a connection and one of the session's
+    per-host slots until its body has been read or it is closed. Close
+    responses you don't read, or use them as context managers:
+
+    >>> with get(url, stream=True) as r:
+    ...     first = next(r.iter_json(key='issues'))
+
+    A response that is garbage-collected unread is closed, too.
+
     """
 
-    def __init__(self, request):
-        """Call `request` with :mod:`urllib2` and process results.
+    def __init__(self, request, raw, release=None, stream=False):
+        """Read and process the response to ``request``.
 
-        :param request: :class:`urllib2.Request` instance
+        :param request: :class:`Request` instance
+        :param raw: :class:`httplib.HTTPResponse` for ``request``
+        :param release: called with ``raw`` once the body has been read,
+            so the connection can be reused
+        :type release: ``callable``
+        :param stream: leave the body unread until it is accessed
+        :type stream: ``Boolean``
 
         """
 
         self.request = request
-        self.url = None
-        self.raw = None
-        self.encoding = None
-        self.content = None
+        self.url = request.get_full_url()
+        self.raw = raw
+        self._content = None
+        self._release = release
         self.error = None
-        self.status_code = None
-        self.reason = None
-        self.headers = {}
+        self.status_code = raw.status
+        self.reason = RESPONSES.get(self.status_code, raw.reason)
+        # True if the body came from a local store, not the network
+        self.from_cache = False
+
+        # Headers, encoding and decoded bodies are worked out on first use
+        self._headers = None
+        self._encoding = _UNSET
+        self._text = None
+        self._json = _UNSET
+
+        if not stream:
+            self._read()
+
+        if not 200 <= self.status_code < 300:
+            self.error = urllib2.HTTPError(self.url, self.status_code,
+                                           self.reason, raw.msg, None)
+
+    @property
+    def headers(self):
+        """Response headers with lowercase names.
+
+        :returns: ``dict``
+
+        """
 
-        # Execute query
+        if self._headers is None:
+            # Keys of the parsed message are already lowercase
+            self._headers = dict(self.raw.msg.dict)
+        return self._headers
+
+    @property
+    def mimetype(self):
+        """MIME type from the ``Content-Type`` header."""
+        return self.raw.msg.gettype()
+
+    @property
+    def transfer_encoding(self):
+        """``Content-Transfer-Encoding`` of the response."""
+        return self.raw.msg.getencoding()
+
+    @property
+    def encoding(self):
+        """Character encoding of the body or ``None``.
+
+        Taken from the ``Content-Type`` header or, for HTML and XML, from a
+        declaration in the first :data:`SNIFF_BYTES` of the body. Until a
+        streamed body has been read, only the header is consulted.
+
+        """
+
+        if self._encoding is _UNSET:
+            if self._content is None:
+                return self._get_encoding(sniff=False)
+            self._encoding = self._get_encoding()
+        return self._encoding
+
+    @encoding.setter
+    def encoding(self, value):
+        self._encoding = value
+        self._text = None
+        self._json = _UNSET
+
+    @property
+    def content(self):
+        """Body of the response, decompressed if necessary.
+
+        :returns: ``str``
+
+        """
+
+        if self._content is None:
+            self._read()
+        return self._content
+
+    def _read(self):
+        """Read (the rest of) the body into :attr:`content`."""
+        self._content = ''.join(self.iter_content(1024 * 1024))
+
+    def iter_content(self, chunk_size=8192):
+        """Iterate over the body in chunks, decompressing if necessary.
+
+        The connection goes back to the pool once the body is exhausted.
+        If iteration stops early, the connection is closed instead.
+
+        :param chunk_size: number of bytes to read at a time. Chunks may
+            be larger after decompression.
+        :type chunk_size: ``int``
+        :returns: iterator of ``str``
+
+        """
+
+        if self._content is not None:
+            for i in range(0, len(self._content), chunk_size):
+                yield self._content[i:i + chunk_size]
+            return
+
+        decoder = get_decoder(self.raw.msg.getheader('content-encoding'))
         try:
-            self.raw = urllib2.urlopen(request)
-        except urllib2.HTTPError as err:
-            self.error = err
-            try:
-                self.url = err.geturl()
-            # sometimes (e.g. when authentication fails)
-            # urllib can't get a URL from an HTTPError
-            except AttributeError:
-                pass
-            self.status_code = err.code
-        else:
-            self.status_code = self.raw.getcode()
-            self.url = self.raw.geturl()
-            self.content = self.raw.read()
-        self.reason = RESPONSES.get(self.status_code)
-
-        # Parse additional info if request succeeded
-        if not self.error:
-            headers = self.raw.info()
-            self.transfer_encoding = headers.getencoding()
-            self.mimetype = headers.gettype()
-            for key in headers.keys():
-                self.headers[key.lower()] = headers.get(key)
-            self.encoding = self._get_encoding()
+            while True:
+                chunk = self.raw.read(chunk_size)
+                if not chunk:
+                    break
+                if decoder:
+                    chunk = decoder.decompress(chunk)
+                if chunk:
+                    yield chunk
+            if decoder:
+                chunk = decoder.flush()
+                if chunk:
+                    yield chunk
+        finally:
+            self.close()
+
+    def iter_json(self, chunk_size=65536, key=None):
+        """Parse the body incrementally, yielding elements of a JSON array.
+
+        :param chunk_size: number of bytes to read at a time
+        :type chunk_size: ``int``
+        :param key: if the body is an object, the key of the array to
+            iterate over, e.g. ``'issues'`` for a Jira search
+        :type key: ``unicode``
+        :returns: iterator of decoded array elements
+
+        """
+
+        return iter_json_items(self.iter_content(chunk_size), key,
+                               self.encoding or 'utf-8')
+
+    def close(self):
+        """Release the connection. Unread body data is discarded."""
+        release, self._release = self._release, None
+        if release:
+            release(self.raw)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        # Don't leak the connection and host slot of an abandoned stream
+        if getattr(self, '_release', None):
+            self.close()
 
     def json(self):
         """Decode response contents as JSON.
 
+        The body is only parsed once; later calls return the same object.
+
         :returns: decoded JSON
         :rtype: ``list`` / ``dict``
 
         """
 
-        return json.loads(self.content, self.encoding or 'utf-8')
+        if self._json is _UNSET:
+            self._json = json.loads(self.content, self.encoding or 'utf-8')
+        return self._json
 
     @property
     def text(self):
@@ -201,10 +673,14 @@ class Response(object):
 
         """
 
-        if self.encoding:
-            return unicodedata.normalize('NFC', unicode(self.content,
-                                                        self.encoding))
-        return self.content
+        if self._text is None:
+            encoding = self.encoding
+            if encoding:
+                self._text = unicodedata.normalize(
+                    'NFC', unicode(self.content, encoding))
+            else:
+                self._text = self.content
+        return self._text
 
     def raise_for_status(self):
         """Raise stored error if one occurred.
@@ -216,28 +692,32 @@ class Response(object):
             raise self.error
         return
 
-    def _get_encoding(self):
+    def _get_encoding(self, sniff=True):
         """Get encoding from HTTP headers or content.
 
+        :param sniff: look for ``<meta>``/``<?xml>`` declarations in
+            the content of HTML and XML documents
+        :type sniff: ``Boolean``
         :returns: encoding or `None`
         :rtype: ``unicode`` or ``None``
 
         """
 
         # HTTP Content-Type header
-        headers = self.raw.info()
+        headers = self.raw.msg
         # _, params = cgi.parse_header(self.headers.get('content-type'))
         encoding = headers.getparam('charset')
-        if self.mimetype == 'text/html':  # sniff HTML headers
-            m = re.search("""<meta.+charset=["']{0,1}(.+)["'].*>""",
-                          self.content)
+        if not sniff:
+            if self.mimetype == 'application/json' and not encoding:
+                encoding = 'utf-8'
+        elif self.mimetype == 'text/html':  # sniff HTML headers
+            m = _META_CHARSET.search(self.content, 0, SNIFF_BYTES)
             if m:
                 encoding = m.group(1)
         elif ((self.mimetype.startswith('application/') or
                self.mimetype.startswith('text/')) and
               'xml' in self.mimetype):
-            m = re.search("""<?xml.+encoding=["'](.+?)["'].*>""",
-                          self.content)
+            m = _XML_ENCODING.search(self.content, 0, SNIFF_BYTES)
             if m:
                 encoding = m.group(1)
         elif self.mimetype == 'application/json' and not encoding:
@@ -248,10 +728,1601 @@ class Response(object):
         return encoding
 
 
+class CachedRaw(object):
+    """Stand-in for :class:`httplib.HTTPResponse` that replays a stored
+    response, so it can be wrapped in a :class:`Response`.
+
+    :param entry: as saved by :meth:`HTTPCache.save`
+    :type entry: ``dict``
+
+    """
+
+    will_close = False
+
+    def __init__(self, entry):
+        self.status = entry['status']
+        self.reason = entry['reason']
+        self.msg = httplib.HTTPMessage(cStringIO.StringIO(entry['headers']))
+        self._content = entry['content']
+        self._offset = 0
+
+    def read(self, amt=None):
+        start = self._offset
+        if amt is None:
+            self._offset = len(self._content)
+        else:
+            self._offset = min(start + amt, len(self._content))
+        return self._content[start:self._offset]
+
+    def close(self):
+        pass
+
+
+def _cachefile(filename):
+    """Return path to ``filename`` in the workflow's cache directory."""
+    from .workflow import Workflow
+    return Workflow().cachefile(filename)
+
+
+def _cache_control(value):
+    """Parse a ``Cache-Control`` header into a ``dict``.
+
+    Directives without a value map to ``True``.
+
+    """
+
+    directives = {}
+    for part in (value or '').split(','):
+        name, _, arg = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = arg.strip('"') or True
+    return directives
+
+
+def _http_date(value):
+    """Return HTTP date ``value`` as a timestamp or ``None``."""
+    parsed = email.utils.parsedate_tz(value or '')
+    if parsed is None:
+        return None
+    return email.utils.mktime_tz(parsed)
+
+
+class HTTPCache(object):
+    """Private HTTP cache for ``GET`` responses, following RFC 7234.
+
+    A stored response is returned without contacting the server while it
+    is fresh according to its ``Cache-Control: max-age`` or ``Expires``
+    header. Once stale, or if the server asked for ``no-cache``, it is
+    revalidated with ``If-None-Match``/``If-Modified-Since`` and, when
+    the server answers ``304 Not Modified``, returned again with its
+    freshness renewed. Responses marked ``no-store`` and ``Vary: *`` are
+    never stored. Responses with other ``Vary`` headers are stored once
+    per combination of the request headers they vary on. Freshness is
+    never guessed from ``Last-Modified``.
+
+    :attr:`Response.from_cache` is set on responses from the cache.
+    Requests sending ``Cache-Control: no-cache`` skip fresh entries and
+    ``no-store`` bypasses the cache entirely.
+
+    Entries are keyed by URL and ``Authorization`` header, one pickle per
+    entry, so the cache is shared by every process using the directory.
+    Identical requests made at the same time, from any thread or process,
+    wait for the first one to finish and share its response, for as long
+    as their timeout and deadline allow. Least
+    recently used entries are removed when the cache grows past
+    ``max_size``.
+
+    :param dirpath: directory to keep entries in. Defaults to
+        ``http_cache`` in the workflow's cache directory.
+    :type dirpath: ``unicode``
+    :param max_size: size limit of the cache in bytes
+    :type max_size: ``int``
+
+    """
+
+    def __init__(self, dirpath=None, max_size=HTTP_CACHE_SIZE):
+        self._dirpath = dirpath
+        self.max_size = max_size
+
+    @property
+    def dirpath(self):
+        """Directory entries are stored in (created if necessary)."""
+        if not self._dirpath:
+            self._dirpath = _cachefile('http_cache')
+        if not os.path.exists(self._dirpath):
+            os.makedirs(self._dirpath)
+        return self._dirpath
+
+    def _key(self, req):
+        """Return key of the entries for URL and credentials of ``req``."""
+        return hashlib.sha1('%s\n%s' % (
+            req.get_full_url(), req.get_header('Authorization', ''))
+        ).hexdigest()
+
+    def path(self, req):
+        """Return path of the entry for :class:`Request` ``req``.
+
+        If the last response stored for the URL had a ``Vary`` header, the
+        path also depends on the values of the headers named in it.
+
+        """
+
+        key = self._key(req)
+        try:
+            with open(os.path.join(self.dirpath, key + '.vary'), 'rb') as file:
+                names = file.read().split()
+        except IOError:
+            return os.path.join(self.dirpath, key)
+
+        values = '\n'.join('%s: %s' % (name, req.get_header(
+            name.capitalize(), '')) for name in names)
+        return os.path.join(self.dirpath,
+                            hashlib.sha1(key + '\n' + values).hexdigest())
+
+    def _set_vary(self, req, names):
+        """Remember the headers responses to ``req``'s URL vary on."""
+        path = os.path.join(self.dirpath, self._key(req) + '.vary')
+        if not names:
+            if os.path.exists(path):
+                os.unlink(path)
+            return
+        tmp = '%s.%d.%d' % (path, os.getpid(), threading.current_thread().ident)
+        with open(tmp, 'wb') as file:
+            file.write(' '.join(sorted(names)))
+        os.rename(tmp, path)
+
+    @contextmanager
+    def lock(self, req):
+        """Try to hold an exclusive lock on the entry for ``req``.
+
+        Waits no longer than the request's deadline or read timeout allow.
+        Yields ``True`` if the lock was acquired, ``False`` if it is held
+        elsewhere for too long or the cache directory is unusable.
+
+        """
+
+        file = None
+        try:
+            _, wait = req.timeouts()
+            give_up = None if wait is None else time.time() + wait
+            file = open(self.path(req) + '.lock', 'ab')
+            while True:
+                try:
+                    fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except IOError as err:
+                    if err.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+                if give_up is not None and time.time() >= give_up:
+                    log.debug('HTTP cache entry busy : %s',
+                              req.get_full_url())
+                    file.close()
+                    file = None
+                    break
+                time.sleep(CACHE_LOCK_POLL)
+        except (IOError, OSError) as err:  # no usable cache directory
+            log.debug('Could not lock HTTP cache entry : %s', err)
+            if file:
+                file.close()
+                file = None
+        try:
+            yield file is not None
+        finally:
+            if file:
+                file.close()  # releases the lock
+
+    def get(self, req):
+        """Return stored entry matching ``req`` or ``None``."""
+        try:
+            with open(self.path(req), 'rb') as file:
+                entry = pickle.load(file)
+        except (IOError, EOFError, ValueError, pickle.UnpicklingError):
+            return None
+
+        for name, value in entry['vary'].items():
+            if req.get_header(name.capitalize()) != value:
+                return None
+        return entry
+
+    def fresh(self, req, entry):
+        """Return ``True`` if ``entry`` may be used without revalidation."""
+        if 'no-cache' in _cache_control(req.get_header('Cache-control')):
+            return False
+        if entry['expires'] is None or time.time() >= entry['expires']:
+            return False
+        try:  # Keep recently used entries
+            os.utime(self.path(req), None)
+        except OSError:
+            pass
+        return True
+
+    def _expires(self, headers, now):
+        """Return time at which a response with ``headers`` goes stale.
+
+        :returns: timestamp or ``None`` if it must always be revalidated
+
+        """
+
+        directives = _cache_control(headers.get('cache-control'))
+        if 'no-cache' in directives:
+            return None
+
+        if 'max-age' in directives:
+            try:
+                lifetime = int(directives['max-age'])
+            except ValueError:
+                return None
+        elif headers.get('expires'):
+            expires = _http_date(headers['expires'])
+            if expires is None:
+                return None
+            lifetime = expires - (_http_date(headers.get('date')) or now)
+        else:
+            return None
+
+        try:
+            age = int(headers.get('age') or 0)
+        except ValueError:
+            age = 0
+        if lifetime - age <= 0:
+            return None
+        return now + lifetime - age
+
+    def save(self, req, response):
+        """Store ``response`` to ``req`` if it is cacheable."""
+        headers = response.raw.msg
+        directives = _cache_control(headers.get('cache-control'))
+        if ('no-store' in directives or
+                'no-store' in _cache_control(req.get_header('Cache-control'))):
+            return
+
+        vary = [name.strip().lower()
+                for name in headers.get('vary', '').split(',')
+                if name.strip()]
+        if '*' in vary:
+            return
+        # Stored content doesn't depend on Accept-Encoding
+        vary = [name for name in vary if name != 'accept-encoding']
+
+        now = time.time()
+        expires = self._expires(headers, now)
+        if (expires is None and 'etag' not in headers and
+                'last-modified' not in headers):
+            return
+
+        # The stored body is already decompressed
+        raw_headers = ''.join(
+            line for line in headers.headers
+            if line.split(':', 1)[0].strip().lower() not in
+            ('content-encoding', 'content-length', 'transfer-encoding'))
+        entry = {
+            'url': req.get_full_url(),
+            'vary': dict((name, req.get_header(name.capitalize()))
+                         for name in vary),
+            'expires': expires,
+            'etag': headers.get('etag'),
+            'last_modified': headers.get('last-modified'),
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': raw_headers,
+            'content': response.content,
+        }
+        self._set_vary(req, vary)
+        self._write(req, entry)
+
+    def refresh(self, req, entry, response):
+        """Update ``entry`` from ``304 Not Modified`` ``response``.
+
+        :returns: the updated entry
+
+        """
+
+        headers = response.raw.msg
+        entry = dict(entry, expires=self._expires(headers, time.time()))
+        for key, name in (('etag', 'etag'), ('last_modified', 'last-modified')):
+            if headers.get(name):
+                entry[key] = headers[name]
+        self._write(req, entry)
+        return entry
+
+    def _write(self, req, entry):
+        """Atomically write ``entry`` for ``req`` and enforce the size limit."""
+        path = self.path(req)
+        tmp = '%s.%d.%d' % (path, os.getpid(), threading.current_thread().ident)
+        with open(tmp, 'wb') as file:
+            pickle.dump(entry, file, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, path)
+        self._evict()
+
+    def _evict(self):
+        """Delete least recently used entries while over :attr:`max_size`."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.dirpath):
+            if len(name) != 40:  # lock and temporary files
+                continue
+            path = os.path.join(self.dirpath, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            for filepath in (path, path + '.lock'):
+                try:
+                    os.unlink(filepath)
+                except OSError:
+                    pass
+            total -= size
+
+    def conditional_headers(self, entry):
+        """Return validator headers to send for stored ``entry``."""
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+
+def _is_ip(host):
+    """Return ``True`` if ``host`` is an IPv4 or IPv6 address."""
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, host)
+            return True
+        except (socket.error, ValueError):
+            pass
+    return False
+
+
+class DNSCache(object):
+    """Share resolved host addresses between processes.
+
+    Every script-filter process otherwise resolves the same hostnames
+    again. Addresses are kept for ``ttl`` seconds in a JSON file in the
+    cache directory. If connecting to every cached address fails, the
+    host is resolved afresh and tried once more, so a moved host costs
+    one failed connect, not ``ttl`` seconds of failures.
+
+    :class:`Session` uses the cache for new connections when given one.
+    The module-level functions use it if the environment variable
+    ``WORKFLOW_WEB_DNS_CACHE=1`` is set.
+
+    :param path: path of the cache file. Defaults to ``dns_cache.json``
+        in the workflow's cache directory.
+    :type path: ``unicode``
+    :param ttl: seconds resolved addresses are used for
+    :type ttl: ``int``
+
+    """
+
+    def __init__(self, path=None, ttl=DNS_TTL):
+        self._path = path
+        self.ttl = ttl
+        # {host: {'expires': timestamp, 'addresses': [[family, ip], ...]}}
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        """Path of the cache file."""
+        if not self._path:
+            self._path = _cachefile('dns_cache.json')
+        return self._path
+
+    def _read(self):
+        try:
+            with open(self.path, 'rb') as file:
+                return json.load(file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _fresh(self, host, now):
+        """Return unexpired addresses of ``host`` or ``None``."""
+        entry = self._entries.get(host)
+        if entry and entry['expires'] > now:
+            return entry['addresses']
+        return None
+
+    def addresses(self, host, port, fresh=False):
+        """Return ``[(family, ip), ...]`` for ``host``.
+
+        :param fresh: resolve ``host`` even if it is in the cache
+        :type fresh: ``Boolean``
+        :returns: ``(addresses, cached)``
+        :rtype: ``tuple``
+
+        """
+
+        now = time.time()
+        with self._lock:
+            if not fresh:
+                addresses = self._fresh(host, now)
+                if addresses is None:  # maybe another process resolved it
+                    self._entries.update(self._read())
+                    addresses = self._fresh(host, now)
+                if addresses is not None:
+                    return (addresses, True)
+
+        addresses = []
+        for family, _, _, _, sockaddr in socket.getaddrinfo(
+                host, port, 0, socket.SOCK_STREAM):
+            if [family, sockaddr[0]] not in addresses:
+                addresses.append([family, sockaddr[0]])
+        log.debug('Resolved %s : %s', host, [a[1] for a in addresses])
+
+        with self._lock:
+            entries = self._read()
+            entries[host] = {'expires': now + self.ttl,
+                             'addresses': addresses}
+            self._entries.update(entries)
+            try:
+                tmp = '%s.%d.%d' % (self.path, os.getpid(),
+                                    threading.current_thread().ident)
+                with open(tmp, 'wb') as file:
+                    json.dump(entries, file)
+                os.rename(tmp, self.path)
+            except (IOError, OSError) as err:
+                log.debug('Could not save DNS cache : %s', err)
+        return (addresses, False)
+
+    def create_connection(self, address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+                          source_address=None):
+        """Drop-in replacement for :func:`socket.create_connection` that
+        resolves ``address`` through the cache."""
+        host, port = address
+        if _is_ip(host):
+            return socket.create_connection(address, timeout, source_address)
+
+        try:
+            addresses, cached = self.addresses(host, port)
+        except socket.gaierror:  # lookup failed; don't try it again below
+            raise
+        except (IOError, OSError) as err:  # no usable cache directory
+            log.debug('DNS cache unavailable : %s', err)
+            return socket.create_connection(address, timeout, source_address)
+
+        try:
+            return self._connect(addresses, port, timeout, source_address)
+        except socket.error as err:
+            if not cached:
+                raise
+            log.debug('Cached addresses of %s failed (%s), resolving again',
+                      host, err)
+            addresses, _ = self.addresses(host, port, fresh=True)
+            return self._connect(addresses, port, timeout, source_address)
+
+    def _connect(self, addresses, port, timeout, source_address):
+        """Connect to the first of ``addresses`` that accepts."""
+        error = socket.error('no addresses to connect to')
+        for family, ip in addresses:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            try:
+                if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                    sock.settimeout(timeout)
+                if source_address:
+                    sock.bind(source_address)
+                sock.connect((ip, port))
+                return sock
+            except socket.error as err:
+                error = err
+                sock.close()
+        raise error
+
+
+class HostUnreachable(socket.error):
+    """Raised without trying to connect to a host that recently couldn't
+    be reached.
+
+    A subclass of :class:`socket.error`, so code handling connection
+    errors handles this too.
+
+    """
+
+
+class OfflineTracker(object):
+    """Fail fast on hosts that couldn't be reached a moment ago.
+
+    When a request still can't connect to a host after its retries,
+    :class:`Session` marks the host down in a file shared by all processes
+    using the directory. For the next
+    ``ttl`` seconds, requests to the host raise :class:`HostUnreachable`
+    at once instead of waiting for the connect timeout again. After that,
+    the next request first probes the host with a plain TCP connection
+    limited to ``probe_timeout`` seconds, and only proceeds if it
+    succeeds. Any successful connection marks the host up again.
+
+    Hosts that have never failed cost nothing to check beyond one
+    :func:`os.stat` call per new connection.
+
+    :param dirpath: directory for the markers. Defaults to ``offline``
+        in the workflow's cache directory.
+    :type dirpath: ``unicode``
+    :param ttl: seconds a host is considered down after a failure
+    :type ttl: ``int``
+    :param probe_timeout: connect timeout of the probe
+    :type probe_timeout: ``float``
+
+    """
+
+    def __init__(self, dirpath=None, ttl=OFFLINE_TTL,
+                 probe_timeout=PROBE_TIMEOUT):
+        self._dirpath = dirpath
+        self.ttl = ttl
+        self.probe_timeout = probe_timeout
+
+    @property
+    def dirpath(self):
+        """Directory markers are stored in (created if necessary)."""
+        if not self._dirpath:
+            self._dirpath = _cachefile('offline')
+        if not os.path.exists(self._dirpath):
+            os.makedirs(self._dirpath)
+        return self._dirpath
+
+    def path(self, host, port):
+        """Return path of the marker for ``host``:``port``."""
+        return os.path.join(self.dirpath, '%s_%s' % (host, port))
+
+    def check(self, host, port):
+        """Make sure ``host`` isn't known to be unreachable.
+
+        :raises: :class:`HostUnreachable` if it is
+
+        """
+
+        path = self.path(host, port)
+        try:
+            failed_at = os.stat(path).st_mtime
+        except OSError:  # never failed, or since recovered
+            return
+
+        if time.time() - failed_at < self.ttl:
+            raise HostUnreachable('%s:%s unreachable (cached)' % (host, port))
+
+        try:
+            socket.create_connection((host, port), self.probe_timeout).close()
+        except socket.error as err:
+            self.failed(host, port)
+            raise HostUnreachable('%s:%s unreachable : %s' % (host, port, err))
+        self.succeeded(host, port)
+
+    def failed(self, host, port):
+        """Mark ``host`` down."""
+        path = self.path(host, port)
+        with open(path, 'wb'):
+            pass
+        os.utime(path, None)
+
+    def succeeded(self, host, port):
+        """Mark ``host`` up."""
+        try:
+            os.unlink(self.path(host, port))
+        except OSError:
+            pass
+
+
+class RateLimitExceeded(Exception):
+    """Raised instead of sending a request that would exceed a host's
+    rate limit, or that would have to wait too long for it to reset.
+
+    :attr:`retry_at` is the Unix time when the host should accept
+    requests again.
+
+    """
+
+    def __init__(self, host, retry_at):
+        self.host = host
+        self.retry_at = retry_at
+        super(RateLimitExceeded, self).__init__(
+            'Rate limit for %s exhausted for another %ds' % (
+                host, retry_at - time.time()))
+
+
+class RateLimiter(object):
+    """Keep requests to each host within the limits the host announces.
+
+    Limits are learned from responses: GitHub-style
+    ``X-RateLimit-Limit``/``-Remaining``/``-Reset`` headers give a budget
+    per window, and ``Retry-After`` on ``429``/``503`` responses blocks
+    the host for a while. Each request sent spends one unit of the
+    budget, which refills when the window resets.
+
+    The state is shared between processes through a JSON file (in the
+    workflow's cache directory by default), so background refreshes and
+    keystroke processes draw on the same budget.
+
+    :data:`PRIORITY_BACKGROUND` requests stop once only ``reserve`` of the
+    budget is left, leaving it to :data:`PRIORITY_INTERACTIVE` requests.
+    A request that can't be sent yet waits if the wait is within
+    ``max_delay`` for its priority, and raises :class:`RateLimitExceeded`
+    otherwise.
+
+    :param path: path of the state file
+    :type path: ``unicode``
+    :param reserve: fraction of each budget kept for interactive requests
+    :type reserve: ``float``
+    :param max_delay: longest wait in seconds, per priority
+    :type max_delay: ``dict``
+
+    """
+
+    def __init__(self, path=None, reserve=0.2, max_delay=None):
+        self._path = path
+        self.reserve = reserve
+        self.max_delay = {PRIORITY_INTERACTIVE: 2, PRIORITY_BACKGROUND: 60}
+        self.max_delay.update(max_delay or {})
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        """Path to the state file."""
+        if not self._path:
+            self._path = _cachefile('rate_limits.json')
+        return self._path
+
+    @contextmanager
+    def _state(self):
+        """Lock, load and yield the state, then save it."""
+        with self._lock, open(self.path, 'a+') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                file.seek(0)
+                try:
+                    state = json.load(file)
+                except ValueError:  # new or corrupt file
+                    state = {}
+                yield state
+                file.seek(0)
+                file.truncate()
+                json.dump(state, file)
+                file.flush()
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def _delay(self, entry, priority, now):
+        """Seconds until a request with ``priority`` may be sent."""
+        if entry.get('blocked_until', 0) > now:
+            return entry['blocked_until'] - now
+
+        limit = entry.get('limit')
+        if limit is None or entry.get('remaining') is None:
+            return 0
+        if entry.get('reset') and entry['reset'] <= now:  # window over
+            entry['remaining'] = limit
+            entry['reset'] = None
+
+        floor = 0
+        if priority == PRIORITY_BACKGROUND:
+            floor = int(limit * self.reserve)
+        if entry['remaining'] > floor:
+            return 0
+        if not entry.get('reset'):  # unknown reset, try again later
+            return 60
+        return entry['reset'] - now
+
+    def acquire(self, host, priority=PRIORITY_INTERACTIVE):
+        """Wait until a request to ``host`` may be sent and spend one unit
+        of its budget.
+
+        :raises: :class:`RateLimitExceeded` if the wait would be too long
+
+        """
+
+        while True:
+            now = time.time()
+            with self._state() as state:
+                entry = state.setdefault(host, {})
+                delay = self._delay(entry, priority, now)
+                if not delay:
+                    if entry.get('remaining') is not None:
+                        entry['remaining'] -= 1
+                    return
+            if delay > self.max_delay.get(priority, 0):
+                raise RateLimitExceeded(host, now + delay)
+            log.debug('Waiting %0.1fs for rate limit of %s', delay, host)
+            time.sleep(delay)
+
+    def update(self, host, response):
+        """Learn the limits of ``host`` from ``response`` headers."""
+        headers = response.raw.msg
+        now = time.time()
+        with self._state() as state:
+            entry = state.setdefault(host, {})
+            try:
+                if 'x-ratelimit-remaining' in headers:
+                    entry['remaining'] = int(headers['x-ratelimit-remaining'])
+                    entry['limit'] = int(headers.get(
+                        'x-ratelimit-limit', entry.get('limit') or
+                        entry['remaining']))
+                    if 'x-ratelimit-reset' in headers:
+                        entry['reset'] = int(headers['x-ratelimit-reset'])
+            except ValueError:
+                log.debug('Bad rate limit headers from %s', host)
+
+            if response.status_code in (429, 503):
+                delay = _retry_after(headers.get('retry-after'), now)
+                if delay is None and response.status_code == 429:
+                    delay = 5
+                if delay:
+                    entry['blocked_until'] = now + delay
+
+
+def _retry_after(value, now):
+    """Parse a ``Retry-After`` header (seconds or HTTP date).
+
+    :returns: seconds to wait or ``None``
+
+    """
+
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0, email.utils.mktime_tz(parsed) - now)
+
+
+class CassetteError(Exception):
+    """Raised when a :class:`Cassette` has no recording for a request."""
+
+
+class ReplayRaw(CachedRaw):
+    """:class:`CachedRaw` that delivers its body at a limited rate.
+
+    :param entry: as for :class:`CachedRaw`
+    :param bandwidth: bytes per second or ``None`` for no limit
+    :type bandwidth: ``int``
+
+    """
+
+    def __init__(self, entry, bandwidth=None):
+        CachedRaw.__init__(self, entry)
+        self.bandwidth = bandwidth
+
+    def read(self, amt=None):
+        chunk = CachedRaw.read(self, amt)
+        if self.bandwidth and chunk:
+            time.sleep(float(len(chunk)) / self.bandwidth)
+        return chunk
+
+
+class Cassette(object):
+    """Record responses to a file and replay them without a network.
+
+    In ``record`` mode, every response a :class:`Session` receives is
+    appended to the cassette at ``path``, a JSON file that can be checked
+    in. Request bodies are not recorded. The values of
+    :data:`SCRUB_HEADERS` and :data:`SCRUB_PARAMS` are replaced with
+    :data:`REDACTED` before anything is written.
+
+    Responses a session answers from its :class:`HTTPCache` are recorded
+    too, and the cache isn't revalidated while recording, since a
+    ``304 Not Modified`` would have nothing to refer to on replay.
+
+    In ``replay`` mode, no connections are made and the session's
+    :class:`HTTPCache` is neither read nor written. Requests are matched on
+    method and (scrubbed) URL. Several recordings for the same request are
+    replayed in order, the last one repeating. A request that was never
+    recorded raises :class:`CassetteError`.
+
+    Replayed responses arrive after ``latency`` seconds and their bodies at
+    ``bandwidth`` bytes per second, so runs are repeatable and can model a
+    slow network.
+
+    >>> session = Session(cassette=Cassette('jira.json', 'record'))
+
+    :param path: path of the cassette file
+    :type path: ``unicode``
+    :param mode: ``'record'`` or ``'replay'``
+    :type mode: ``str``
+    :param latency: seconds before each replayed response, or ``None``
+        to wait as long as the recorded response took
+    :type latency: ``float``
+    :param bandwidth: bytes per second for replayed bodies, or ``None``
+        for no limit
+    :type bandwidth: ``int``
+
+    """
+
+    def __init__(self, path, mode='replay', latency=0, bandwidth=None):
+        if mode not in ('record', 'replay'):
+            raise ValueError('Unknown cassette mode : %r' % mode)
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self._lock = threading.Lock()
+        self._interactions = []
+        # Replay position for each (method, url): {key: index}
+        self._played = {}
+        if mode == 'replay' or os.path.exists(path):
+            with open(path, 'rb') as file:
+                self._interactions = json.load(file)
+
+    @classmethod
+    def from_environ(cls):
+        """Return the :class:`Cassette` configured by the environment.
+
+        ``WORKFLOW_WEB_CASSETTE`` is the path of the cassette and
+        ``WORKFLOW_WEB_CASSETTE_MODE`` its mode (default ``replay``).
+        ``WORKFLOW_WEB_LATENCY`` (milliseconds) and
+        ``WORKFLOW_WEB_BANDWIDTH`` (bytes per second) shape replays.
+
+        :returns: :class:`Cassette` or ``None`` if none is configured
+
+        """
+
+        path = os.environ.get('WORKFLOW_WEB_CASSETTE')
+        if not path:
+            return None
+        latency = os.environ.get('WORKFLOW_WEB_LATENCY')
+        bandwidth = os.environ.get('WORKFLOW_WEB_BANDWIDTH')
+        return cls(path, os.environ.get('WORKFLOW_WEB_CASSETTE_MODE',
+                                        'replay'),
+                   int(latency) / 1000.0 if latency else 0,
+                   int(bandwidth) if bandwidth else None)
+
+    @property
+    def replaying(self):
+        """``True`` if responses come from the cassette."""
+        return self.mode == 'replay'
+
+    def scrub_url(self, url):
+        """Return ``url`` with the values of :data:`SCRUB_PARAMS` redacted."""
+        parts = urlparse.urlsplit(url)
+        if not parts.query:
+            return url
+        query = urllib.urlencode([
+            (k, REDACTED if k.lower() in SCRUB_PARAMS else v)
+            for k, v in urlparse.parse_qsl(parts.query, True)])
+        return urlparse.urlunsplit(parts[:3] + (query,) + parts[4:])
+
+    def _scrub_line(self, line):
+        """Redact header ``line`` if it's in :data:`SCRUB_HEADERS`."""
+        name = line.split(':', 1)[0]
+        if name.strip().lower() in SCRUB_HEADERS:
+            return '%s: %s' % (name, REDACTED)
+        return line.rstrip('\r\n')
+
+    def record(self, req, response, elapsed):
+        """Append ``response`` to ``req`` to the cassette and save it.
+
+        :param elapsed: seconds the response took
+        :type elapsed: ``float``
+
+        """
+
+        content = response.content
+        try:
+            body, encoding = content.decode('utf-8'), 'utf-8'
+        except UnicodeDecodeError:
+            body, encoding = base64.b64encode(content), 'base64'
+
+        headers = dict((k, REDACTED if k.lower() in SCRUB_HEADERS else v)
+                       for k, v in req.header_items())
+        # The recorded body is already decompressed
+        lines = [self._scrub_line(line) for line in response.raw.msg.headers
+                 if line.split(':', 1)[0].strip().lower() not in
+                 ('content-encoding', 'content-length', 'transfer-encoding')]
+        interaction = {
+            'request': {
+                'method': req.get_method(),
+                'url': self.scrub_url(req.get_full_url()),
+                'headers': headers,
+            },
+            'response': {
+                'status': response.status_code,
+                'reason': response.reason,
+                'headers': lines,
+                'body': body,
+                'encoding': encoding,
+                'elapsed': round(elapsed, 4),
+            },
+        }
+
+        with self._lock:
+            self._interactions.append(interaction)
+            tmp = '%s.%d' % (self.path, os.getpid())
+            with open(tmp, 'wb') as file:
+                json.dump(self._interactions, file, indent=2, sort_keys=True)
+            os.rename(tmp, self.path)
+
+    def play(self, req):
+        """Return the recorded :class:`Response` to ``req``.
+
+        :raises: :class:`CassetteError` if there is none
+
+        """
+
+        method, url = req.get_method(), self.scrub_url(req.get_full_url())
+        with self._lock:
+            matches = [i for i in self._interactions
+                       if i['request']['method'] == method and
+                       i['request']['url'] == url]
+            if not matches:
+                raise CassetteError('Not in cassette %s : %s %s' % (
+                    self.path, method, url))
+            index = self._played.get((method, url), 0)
+            self._played[(method, url)] = index + 1
+
+        recorded = matches[min(index, len(matches) - 1)]['response']
+        if recorded['encoding'] == 'base64':
+            content = base64.b64decode(recorded['body'])
+        else:
+            content = recorded['body'].encode('utf-8')
+
+        latency = self.latency
+        if latency is None:
+            latency = recorded['elapsed']
+        if latency:
+            time.sleep(latency)
+
+        entry = {
+            'status': recorded['status'],
+            'reason': recorded['reason'].encode('utf-8'),
+            'headers': ''.join(line.encode('utf-8') + '\r\n'
+                               for line in recorded['headers']),
+            'content': content,
+        }
+        return Response(req, ReplayRaw(entry, self.bandwidth),
+                        stream=req.stream)
+
+
+class _HostSlots(object):
+    """Semaphore limiting concurrent requests to one host, whose
+    :meth:`acquire` can time out (Python 2's semaphores can't).
+
+    :param size: number of slots
+    :type size: ``int``
+
+    """
+
+    def __init__(self, size):
+        self._cond = threading.Condition(threading.Lock())
+        self._free = size
+
+    def acquire(self, timeout=None):
+        """Take a slot, waiting up to ``timeout`` seconds for one.
+
+        :returns: ``False`` if none came free in time
+        :rtype: ``Boolean``
+
+        """
+
+        with self._cond:
+            end = None if timeout is None else time.time() + timeout
+            while not self._free:
+                if end is None:
+                    self._cond.wait()
+                    continue
+                left = end - time.time()
+                if left <= 0:
+                    return False
+                self._cond.wait(left)
+            self._free -= 1
+            return True
+
+    def release(self):
+        """Give a slot back."""
+        with self._cond:
+            self._free += 1
+            self._cond.notify()
+
+
+class Session(object):
+    """Make requests over persistent, per-host connections.
+
+    Connections are kept open between requests and reused for the same
+    scheme/host/port, so only the first request to a host pays for the
+    TCP (and TLS) handshake. Headers and ``auth`` set on the session are
+    sent with every request. Sessions are safe to share between threads.
+
+    >>> s = Session(headers={'Accept': 'application/json'}, timeout=10)
+    >>> r = s.get('https://api.github.com/user', auth=(user, token))
+    >>> s.close()
+
+    :param headers: HTTP headers sent with every request
+    :type headers: ``dict``
+    :param auth: username, password used when a request has no ``auth``
+    :type auth: ``tuple``
+    :param timeout: default timeout in seconds or ``(connect, read)``
+        timeouts for each request
+    :type timeout: ``int`` or ``tuple``
+    :param cache: answer ``GET`` requests from this cache where allowed
+    :type cache: :class:`HTTPCache`
+    :param max_per_host: maximum number of concurrent requests to one host;
+        further requests wait for a free slot, until their ``deadline``
+        if they have one. Unread streamed responses hold their slot.
+    :type max_per_host: ``int``
+    :param rate_limiter: schedule requests within the rate limits of each
+        host
+    :type rate_limiter: :class:`RateLimiter`
+    :param retries: times an idempotent request is retried after a
+        connection error or a 502/503/504 response
+    :type retries: ``int``
+    :param retry_read_timeouts: also retry requests whose response didn't
+        arrive within the read timeout
+    :type retry_read_timeouts: ``Boolean``
+    :param backoff_factor: base of the random, exponentially growing wait
+        before each retry. See :data:`BACKOFF_FACTOR`.
+    :type backoff_factor: ``float``
+    :param backoff_max: longest wait before a retry
+    :type backoff_max: ``float``
+    :param cassette: record responses to or replay them from this cassette
+    :type cassette: :class:`Cassette`
+    :param offline: fail fast on hosts that just couldn't be reached
+    :type offline: :class:`OfflineTracker`
+    :param dns_cache: resolve hostnames through this shared cache
+    :type dns_cache: :class:`DNSCache`
+    :param deadline: default ``deadline`` of each call, or ``None``
+    :type deadline: ``int``
+
+    """
+
+    def __init__(self, headers=None, auth=None, timeout=TIMEOUT,
+                 cache=None, max_per_host=MAX_PER_HOST,
+                 rate_limiter=None, retries=RETRIES,
+                 backoff_factor=BACKOFF_FACTOR, backoff_max=BACKOFF_MAX,
+                 cassette=None, offline=None, dns_cache=None, deadline=None,
+                 retry_read_timeouts=False):
+        self.headers = headers or {}
+        self.auth = auth
+        self.timeout = timeout
+        self.cache = cache
+        self.max_per_host = max_per_host
+        self.rate_limiter = rate_limiter
+        self.retries = retries
+        self.retry_read_timeouts = retry_read_timeouts
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.cassette = cassette
+        self.offline = offline
+        self.dns_cache = dns_cache
+        self.deadline = deadline
+        # Concurrency limits: {(scheme, netloc): _HostSlots}
+        self._host_slots = {}
+        # Idle connections: {(scheme, netloc): [conn, ...]}
+        self._pool = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            pool, self._pool = self._pool, {}
+        for conns in pool.values():
+            for conn in conns:
+                conn.close()
+
+    @metrics.timed('network')
+    def request(self, method, url, params=None, data=None, headers=None,
+                cookies=None, files=None, auth=None, timeout=None,
+                allow_redirects=False, stream=False, priority=None,
+                deadline=None):
+        """Initiate an HTTP(S) request. Returns :class:`Response` object.
+
+        Arguments are as for :func:`request`. ``timeout=None`` and
+        ``deadline=None`` use the session's defaults.
+
+        """
+
+        if timeout is None:
+            timeout = self.timeout
+        if deadline is None:
+            deadline = self.deadline
+        if deadline is not None:
+            deadline = time.time() + deadline
+
+        headers = dict(self.headers, **(headers or {}))
+        if 'User-Agent' not in headers:
+            headers['User-Agent'] = USER_AGENT
+        if not any(k.lower() == 'accept-encoding' for k in headers):
+            headers['Accept-Encoding'] = ACCEPT_ENCODING
+
+        auth = auth or self.auth
+        if auth:  # Add authorisation header
+            auth = str_dict({'username': auth[0], 'password': auth[1]})
+            headers['Authorization'] = 'Basic ' + base64.b64encode(
+                '%(username)s:%(password)s' % auth)
+
+        if cookies:
+            headers['Cookie'] = '; '.join(
+                '%s=%s' % item for item in str_dict(cookies).items())
+
+        if files:
+            data = MultipartEncoder(data or {}, files)
+            headers.update(data.headers)
+        elif data and isinstance(data, dict):
+            data = urllib.urlencode(str_dict(data))
+
+        if data is not None and not any(k.lower() == 'content-type'
+                                        for k in headers):
+            # As urllib2 does for any request body
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        # Make sure everything is encoded text
+        headers = str_dict(headers)
+
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+
+        if params:  # GET args (POST args are handled above)
+            url = url + '?' + urllib.urlencode(str_dict(params))
+
+        req = Request(method, url, data, headers, timeout, stream, priority,
+                      deadline)
+        try:
+            response = self._send(req)
+
+            redirects = 0
+            while (allow_redirects and
+                   response.status_code in REDIRECT_CODES and
+                   'location' in response.raw.msg):
+                redirects += 1
+                if redirects > MAX_REDIRECTS:
+                    break
+                response.close()
+                req = self._redirect(req, response)
+                response = self._send(req)
+        finally:
+            if isinstance(data, MultipartEncoder):
+                data.close()
+
+        return response
+
+    def get(self, url, params=None, headers=None, cookies=None, auth=None,
+            timeout=None, allow_redirects=True, stream=False, priority=None,
+            deadline=None):
+        """Initiate a GET request. Arguments as for :func:`request`.
+
+        :returns: :class:`Response` instance
+
+        """
+
+        return self.request('GET', url, params, headers=headers,
+                            cookies=cookies, auth=auth, timeout=timeout,
+                            allow_redirects=allow_redirects, stream=stream,
+                            priority=priority, deadline=deadline)
+
+    def post(self, url, params=None, data=None, headers=None, cookies=None,
+             files=None, auth=None, timeout=None, allow_redirects=False,
+             stream=False, priority=None, deadline=None):
+        """Initiate a POST request. Arguments as for :func:`request`.
+
+        :returns: :class:`Response` instance
+
+        """
+
+        return self.request('POST', url, params, data, headers, cookies,
+                            files, auth, timeout, allow_redirects, stream,
+                            priority, deadline)
+
+    def _redirect(self, req, response):
+        """Return the :class:`Request` to follow redirect ``response``."""
+        url = urlparse.urljoin(req.get_full_url(),
+                               response.raw.msg.getheader('location'))
+        method, data = req.get_method(), req.get_data()
+        if (response.status_code == 303 or
+                (response.status_code in (301, 302) and method == 'POST')):
+            method, data = 'GET', None
+
+        headers = dict(req.headers)
+        if data is None:
+            for key in ('Content-Type', 'Content-Length'):
+                headers.pop(key, None)
+        if urlparse.urlsplit(url)[1] != req.get_host():
+            # Don't hand credentials to another host
+            headers.pop('Authorization', None)
+        return Request(method, url, data, headers, req.timeout, req.stream,
+                       req.priority, req.deadline)
+
+    def _send(self, req):
+        """Send ``req``, answering it from :attr:`cache` if possible.
+
+        The cache is bypassed while :attr:`cassette` is replaying.
+
+        :returns: :class:`Response` instance
+
+        """
+
+        if (not self.cache or req.get_method() != 'GET' or
+                (self.cassette and self.cassette.replaying) or
+                req.has_header('If-none-match') or
+                req.has_header('If-modified-since') or
+                'no-store' in _cache_control(req.get_header('Cache-control'))):
+            return self._transmit(req)
+
+        if req.stream:  # a streamed response may outlive the lock
+            return self._send_cached(req)
+        with self.cache.lock(req) as locked:
+            if locked:
+                return self._send_cached(req)
+        # Don't wait any longer for whoever is fetching it
+        return self._transmit(req)
+
+    def _send_cached(self, req):
+        """Return a response to ``req`` from the cache or the server, and
+        update the cache.
+
+        :returns: :class:`Response` instance
+
+        """
+
+        cache = self.cache
+        try:
+            entry = cache.get(req)
+        except (IOError, OSError) as err:  # no usable cache directory
+            log.debug('HTTP cache unavailable : %s', err)
+            return self._transmit(req)
+
+        if entry and cache.fresh(req, entry):
+            log.debug('Fresh in cache : %s', req.get_full_url())
+            response = self._cached_response(req, entry)
+            if self.cassette:  # recording; replays don't reach the cache
+                self.cassette.record(req, response, 0)
+            return response
+
+        if entry and not self.cassette:
+            for key, value in cache.conditional_headers(entry).items():
+                req.add_unredirected_header(key, value)
+
+        response = self._transmit(req)
+
+        if entry and response.status_code == 304:
+            log.debug('Not modified : %s', req.get_full_url())
+            response.close()  # free its connection and host slot
+            try:
+                entry = cache.refresh(req, entry, response)
+            except (IOError, OSError) as err:
+                log.debug('Could not update HTTP cache : %s', err)
+            response = self._cached_response(req, entry)
+        elif response.status_code == 200 and not req.stream:
+            try:
+                cache.save(req, response)
+            except (IOError, OSError) as err:
+                log.debug('Could not update HTTP cache : %s', err)
+
+        return response
+
+    def _cached_response(self, req, entry):
+        """Return a :class:`Response` to ``req`` from cache ``entry``."""
+        response = Response(req, CachedRaw(entry))
+        response.from_cache = True
+        return response
+
+    def _transmit(self, req):
+        """Send ``req``, retrying after transient failures.
+
+        Idempotent requests are retried up to :attr:`retries` times after
+        a connection error or a response in :data:`RETRY_CODES`, waiting
+        a little longer before each attempt. Read timeouts are only
+        retried with :attr:`retry_read_timeouts`.
+
+        """
+
+        attempt = 0
+        while True:
+            try:
+                response = self._transmit_limited(req)
+            except (DeadlineExceeded, HostUnreachable):
+                raise
+            except (socket.error, httplib.HTTPException) as err:
+                if (isinstance(err, socket.timeout) and not req.unreachable
+                        and not self.retry_read_timeouts):
+                    raise  # read timeout; connect timeouts are retried
+                delay = self._backoff(req, attempt)
+                if delay is None:
+                    self._mark_down(req)
+                    req.remaining()  # report a timeout cut short as such
+                    raise
+                reason = err
+            else:
+                if response.status_code not in RETRY_CODES:
+                    return response
+                delay = self._backoff(req, attempt)
+                if delay is None:
+                    return response
+                response.close()
+                reason = response.status_code
+
+            attempt += 1
+            log.debug('Retry %d of %s %s in %0.2fs after %s', attempt,
+                      req.get_method(), req.get_full_url(), delay, reason)
+            time.sleep(delay)
+
+    def _backoff(self, req, attempt):
+        """Return seconds to wait before retrying ``req``.
+
+        :param attempt: number of retries so far
+        :type attempt: ``int``
+        :returns: ``None`` if ``req`` shouldn't be retried: it isn't
+            idempotent, is out of retries or the wait would pass its
+            deadline
+        :rtype: ``float``
+
+        """
+
+        if (req.get_method() not in IDEMPOTENT_METHODS or
+                attempt >= self.retries):
+            return None
+        delay = random.uniform(0, min(self.backoff_max,
+                                      self.backoff_factor * 2 ** attempt))
+        if req.deadline is not None and time.time() + delay >= req.deadline:
+            return None
+        return delay
+
+    def _transmit_limited(self, req):
+        """Send ``req`` within the host's rate limit, if there is one.
+
+        With a :attr:`cassette`, the response is recorded or replayed.
+
+        """
+
+        cassette = self.cassette
+        if cassette and cassette.replaying:
+            return cassette.play(req)
+
+        limiter = self.rate_limiter
+        host = req.get_host()
+        if limiter:
+            try:
+                limiter.acquire(host, req.priority)
+            except (IOError, OSError) as err:  # no usable cache directory
+                log.debug('Rate limiter unavailable : %s', err)
+                limiter = None
+
+        started = time.time()
+        response = self._transmit_now(req)
+        if cassette:
+            cassette.record(req, response, time.time() - started)
+
+        if limiter:
+            try:
+                limiter.update(host, response)
+            except (IOError, OSError) as err:
+                log.debug('Could not update rate limits : %s', err)
+        return response
+
+    def _transmit_now(self, req):
+        """Send ``req`` over a pooled connection and read the response.
+
+        A reused connection may have been closed by the server since it was
+        last used. If sending an idempotent request over it fails in a way
+        that shows the server never got the request, the host's idle
+        connections are dropped and the request is sent over a new one.
+
+        """
+
+        key = (req.get_type(), req.get_host())
+        proxy = _proxy_for(*key)
+
+        path = req.get_selector()
+        if proxy and key[0] == 'http':  # plain HTTP proxies want the full URL
+            path = req.get_full_url()
+        headers = dict(req.header_items())
+
+        slot = self._host_slot(key)
+        if not slot.acquire(req.remaining()):
+            raise DeadlineExceeded('no free connection to %s : %s' % (
+                key[1], req.get_full_url()))
+        released = []
+        conn = None
+
+        def release(raw):
+            if released:
+                return
+            released.append(True)
+            if raw is None or raw.will_close or not raw.isclosed():
+                conn.close()
+            else:
+                self._release(key, conn)
+            slot.release()
+
+        try:
+            while True:
+                req.unreachable = None
+                connect_timeout, read_timeout = req.timeouts()
+                conn, reused = self._connection(key, proxy, connect_timeout)
+                try:
+                    if conn.sock is None:
+                        self._connect(conn, req)
+                    conn.sock.settimeout(read_timeout)
+                    body = req.get_data()
+                    if isinstance(body, MultipartEncoder):
+                        body.rewind()
+                    conn.request(req.get_method(), path, body, headers)
+                    raw = conn.getresponse()
+                except (socket.error, httplib.HTTPException) as err:
+                    conn.close()
+                    if (reused and _closed_by_server(err) and
+                            req.get_method() in IDEMPOTENT_METHODS):
+                        log.debug('Stale connection to %s : %r', key[1], err)
+                        self._discard_idle(key)
+                        continue
+                    raise
+                break
+            return Response(req, raw, release, req.stream)
+        except BaseException:
+            if not released:
+                released.append(True)
+                if conn is not None:
+                    conn.close()
+                slot.release()
+            raise
+
+    def _connect(self, conn, req):
+        """Open ``conn`` for ``req``, failing fast if its host is known to
+        be down.
+
+        """
+
+        host, port = conn.host, conn.port
+        tracker = self.offline
+        if tracker:
+            try:
+                tracker.check(host, port)
+            except (IOError, OSError) as err:
+                if isinstance(err, HostUnreachable):
+                    raise
+                log.debug('Offline tracker unavailable : %s', err)
+
+        try:
+            conn.connect()
+        except socket.error:
+            # Tells _transmit a timeout was the connect's, and has it
+            # mark the host down if retrying doesn't help
+            req.unreachable = (host, port)
+            raise
+
+    def _mark_down(self, req):
+        """Tell :attr:`offline` if ``req`` gave up failing to connect."""
+        if not self.offline or not req.unreachable:
+            return
+        host, port = req.unreachable
+        try:
+            self.offline.failed(host, port)
+        except (IOError, OSError) as err:
+            log.debug('Could not mark %s down : %s', host, err)
+
+    def _host_slot(self, key):
+        """Return the semaphore limiting concurrent requests to ``key``."""
+        with self._lock:
+            slot = self._host_slots.get(key)
+            if slot is None:
+                slot = self._host_slots[key] = _HostSlots(self.max_per_host)
+        return slot
+
+    def _connection(self, key, proxy, timeout):
+        """Return ``(connection, reused)`` for ``key``."""
+        with self._lock:
+            idle = self._pool.get(key)
+            conn = idle.pop() if idle else None
+
+        while conn is not None:
+            if not _dropped(conn):
+                conn.timeout = timeout
+                return (conn, True)
+            conn.close()
+            with self._lock:
+                idle = self._pool.get(key)
+                conn = idle.pop() if idle else None
+
+        scheme, netloc = key
+        cls = httplib.HTTPSConnection if scheme == 'https' else \
+            httplib.HTTPConnection
+        if not proxy:
+            conn = cls(netloc, timeout=timeout)
+        else:
+            conn = cls(proxy, timeout=timeout)
+            if scheme == 'https':
+                conn.set_tunnel(netloc)
+
+        if self.dns_cache:
+            # Hook httplib uses to open the socket; TLS still verifies
+            # and sends SNI for the hostname
+            conn._create_connection = self.dns_cache.create_connection
+        return (conn, False)
+
+    def _discard_idle(self, key):
+        """Close idle connections to ``key``, which are no fresher than
+        one the server has just turned out to have closed.
+
+        """
+
+        with self._lock:
+            idle = self._pool.pop(key, [])
+        for conn in idle:
+            conn.close()
+
+    def _release(self, key, conn):
+        """Return idle ``conn`` to the pool."""
+        with self._lock:
+            idle = self._pool.setdefault(key, [])
+            if len(idle) < MAX_IDLE_CONNECTIONS:
+                idle.append(conn)
+                return
+        conn.close()
+
+
+def _dropped(conn):
+    """Return ``True`` if idle ``conn`` has been closed by the server.
+
+    An idle connection should have nothing to read, so a readable socket
+    means end of file (or garbage) is waiting.
+
+    """
+
+    if conn.sock is None:
+        return False
+    try:
+        return bool(select.select([conn.sock], [], [], 0)[0])
+    except (select.error, socket.error, ValueError):
+        return True
+
+
+def _closed_by_server(err):
+    """Return ``True`` if ``err`` shows a reused connection was closed
+    before the server sent a single byte of response, so the request
+    can't have been processed.
+
+    Timeouts don't count: the server may have received the request and
+    just be slow.
+
+    """
+
+    if isinstance(err, httplib.BadStatusLine):
+        # Raised with the status line, which is empty if nothing arrived
+        return err.line in ('', "''")
+    if isinstance(err, socket.timeout):
+        return False
+    return (isinstance(err, socket.error) and
+            err.errno in (errno.ECONNRESET, errno.EPIPE))
+
+
+def _proxy_for(scheme, netloc):
+    """Return ``host:port`` of the proxy to use for ``netloc`` or ``None``.
+
+    Honours the ``http_proxy``, ``https_proxy`` and ``no_proxy``
+    environment variables, like :mod:`urllib2`.
+
+    """
+
+    proxy = urllib.getproxies().get(scheme)
+    if not proxy or urllib.proxy_bypass(netloc.split(':')[0]):
+        return None
+    return urlparse.urlsplit(proxy)[1] or proxy
+
+
+# Used by the module-level functions below
+_session = Session(cache=HTTPCache(), rate_limiter=RateLimiter(),
+                   deadline=DEADLINE, cassette=Cassette.from_environ(),
+                   offline=OfflineTracker(),
+                   dns_cache=DNSCache() if os.environ.get(
+                       'WORKFLOW_WEB_DNS_CACHE', '') not in ('', '0') else None)
+
+
 def request(method, url, params=None, data=None, headers=None, cookies=None,
-            files=None, auth=None, timeout=60, allow_redirects=False):
+            files=None, auth=None, timeout=None, allow_redirects=False,
+            stream=False, priority=None, deadline=None):
     """Initiate an HTTP(S) request. Returns :class:`Response` object.
 
+    Connections are pooled in a module-wide :class:`Session`.
+
     :param method: 'GET' or 'POST'
     :type method: ``unicode``
     :param url: URL to open
@@ -264,84 +2335,635 @@ def request(method, url, params=None, data=None, headers=None, cookies=None,
     :type headers: ``dict``
     :param cookies: cookies to send to server
     :type cookies: ``dict``
-    :param files: files to upload
-    :type files:
+    :param files: files to upload. See :func:`encode_multipart_formdata`.
+    :type files: ``dict``
     :param auth: username, password
     :type auth: ``tuple``
-    :param timeout: connection timeout limit in seconds
-    :type timeout: ``int``
+    :param timeout: seconds to wait for the connection and for each read,
+        or a ``(connect, read)`` tuple; defaults to :data:`TIMEOUT`
+    :type timeout: ``int`` or ``tuple``
     :param allow_redirects: follow redirections
     :type allow_redirects: ``Boolean``
+    :param stream: don't read the response body until it is accessed.
+        See :meth:`Response.iter_content`.
+    :type stream: ``Boolean``
+    :param priority: :data:`PRIORITY_INTERACTIVE` or
+        :data:`PRIORITY_BACKGROUND`; defaults to :data:`DEFAULT_PRIORITY`.
+        See :class:`RateLimiter`.
+    :type priority: ``str``
+    :param deadline: seconds the whole call, including retries and
+        redirections, may take; defaults to :data:`DEADLINE`
+    :type deadline: ``int``
     :returns: :class:`Response` object
+    :raises: :class:`RateLimitExceeded` if the host's rate limit doesn't
+        allow the request within a reasonable time
+    :raises: :class:`DeadlineExceeded` if ``deadline`` passes first
+
+    Idempotent requests (``GET``, ``PUT``, ``DELETE``...) are retried
+    :data:`RETRIES` times after connection errors and 502/503/504
+    responses, but not after read timeouts.
 
     """
 
-    socket.setdefaulttimeout(timeout)
+    return _session.request(method, url, params, data, headers, cookies,
+                            files, auth, timeout, allow_redirects, stream,
+                            priority, deadline)
 
-    # Default handlers
-    openers = []
 
-    if not allow_redirects:
-        openers.append(NoRedirectHandler())
+def get(url, params=None, headers=None, cookies=None, auth=None,
+        timeout=None, allow_redirects=True, stream=False, priority=None,
+        deadline=None):
+    """Initiate a GET request. Arguments as for :func:`request` function.
 
-    if auth:  # Add authorisation handler
-        username, password = auth
-        password_manager = urllib2.HTTPPasswordMgrWithDefaultRealm()
-        password_manager.add_password(None, url, username, password)
-        auth_manager = urllib2.HTTPBasicAuthHandler(password_manager)
-        openers.append(auth_manager)
+    :returns: :class:`Response` instance
 
-    # Install our custom chain of openers
-    opener = urllib2.build_opener(*openers)
-    urllib2.install_opener(opener)
+    """
 
-    if not headers:
-        headers = {}
-    if 'User-Agent' not in headers:
-        headers['User-Agent'] = USER_AGENT
+    return _session.get(url, params, headers, cookies, auth, timeout,
+                        allow_redirects, stream, priority, deadline)
 
-    if files:
-        if not data:
-            data = {}
-        new_headers, data = encode_multipart_formdata(data, files)
-        headers.update(new_headers)
-    elif data and isinstance(data, dict):
-        data = urllib.urlencode(str_dict(data))
 
-    # Make sure everything is encoded text
-    headers = str_dict(headers)
+def post(url, params=None, data=None, headers=None, cookies=None, files=None,
+         auth=None, timeout=None, allow_redirects=False, stream=False,
+         priority=None, deadline=None):
+    """Initiate a POST request. Arguments as for :func:`request` function.
+
+    :returns: :class:`Response` instance
 
-    if isinstance(url, unicode):
-        url = url.encode('utf-8')
+    """
+    return _session.post(url, params, data, headers, cookies, files, auth,
+                         timeout, allow_redirects, stream, priority, deadline)
 
-    if params:  # GET args (POST args are handled in encode_multipart_formdata)
-        url = url + '?' + urllib.urlencode(str_dict(params))
 
-    req = urllib2.Request(url, data, headers)
-    return Response(req)
+class Future(object):
+    """Result of a call running on a :class:`WorkerPool`."""
 
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._error = None
+        self._callbacks = []
 
-def get(url, params=None, headers=None, cookies=None, auth=None,
-        timeout=60, allow_redirects=True):
-    """Initiate a GET request. Arguments as for :func:`request` function.
+    def done(self):
+        """Return ``True`` if the call has finished."""
+        return self._event.is_set()
 
-    :returns: :class:`Response` instance
+    def result(self, timeout=None):
+        """Wait for the call to finish and return its result.
+
+        :param timeout: seconds to wait, or ``None`` to wait as long as it
+            takes
+        :type timeout: ``float``
+        :raises: the exception raised by the call, or
+            :class:`socket.timeout` if ``timeout`` passes first
+
+        """
+
+        error = self.exception(timeout)
+        if error is not None:
+            raise error
+        return self._result
+
+    def exception(self, timeout=None):
+        """Wait for the call to finish and return the exception it raised
+        or ``None``.
+
+        :raises: :class:`socket.timeout` if ``timeout`` passes first
+
+        """
+
+        if not self._event.wait(timeout):
+            raise socket.timeout('call still running after %ss' % timeout)
+        return self._error
+
+    def add_done_callback(self, func):
+        """Call ``func`` with this future once the call has finished."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(func)
+                return
+        func(self)
+
+    def _finish(self, result, error):
+        with self._lock:
+            self._result, self._error = result, error
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for func in callbacks:
+            try:
+                func(self)
+            except Exception as err:
+                log.exception(err)
+
+
+class WorkerPool(object):
+    """Run calls on a fixed set of long-lived threads.
+
+    Threads are started as work arrives, up to ``max_workers``, and then
+    kept for the life of the process, so a script filter that makes many
+    concurrent requests doesn't start a thread for each. Calls submitted
+    from one of the pool's own threads run immediately in that thread,
+    so nested fan-outs can't deadlock waiting for a free worker.
+
+    :param max_workers: maximum number of threads
+    :type max_workers: ``int``
 
     """
 
-    return request('GET', url, params, headers=headers, cookies=cookies,
-                   auth=auth, timeout=timeout, allow_redirects=allow_redirects)
+    def __init__(self, max_workers=MAX_WORKERS):
+        self.max_workers = max_workers
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = set()
+        self._idle = 0
 
+    def submit(self, func, *args, **kwargs):
+        """Call ``func(*args, **kwargs)`` on a worker thread.
 
-def post(url, params=None, data=None, headers=None, cookies=None, files=None,
-         auth=None, timeout=60, allow_redirects=False):
-    """Initiate a POST request. Arguments as for :func:`request` function.
+        :returns: :class:`Future` for the call
 
-    :returns: :class:`Response` instance
+        """
+
+        future = Future()
+        if threading.current_thread() in self._threads:
+            self._run(future, func, args, kwargs)
+            return future
+
+        with self._lock:
+            self._queue.put((future, func, args, kwargs))
+            if self._idle:
+                self._idle -= 1
+            elif len(self._threads) < self.max_workers:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                self._threads.add(thread)
+                thread.start()
+        return future
+
+    def _run(self, future, func, args, kwargs):
+        try:
+            result = func(*args, **kwargs)
+        except Exception as err:
+            future._finish(None, err)
+        else:
+            future._finish(result, None)
+
+    def _work(self):
+        while True:
+            self._run(*self._queue.get())
+            with self._lock:
+                if self._queue.empty():
+                    self._idle += 1
+
+
+# Shared worker pools by size: {max_workers: WorkerPool}
+_worker_pools = {}
+_worker_pools_lock = threading.Lock()
+
+
+def _worker_pool(max_workers=MAX_WORKERS):
+    """Return the shared :class:`WorkerPool` with ``max_workers`` threads."""
+    with _worker_pools_lock:
+        pool = _worker_pools.get(max_workers)
+        if pool is None:
+            pool = _worker_pools[max_workers] = WorkerPool(max_workers)
+    return pool
+
+
+def submit(method, url, session=None, **kwargs):
+    """Start a request in the background. Returns a :class:`Future`.
+
+    Arguments are as for :func:`request`. Requests share a pool of
+    :data:`MAX_WORKERS` threads and the pooled connections and
+    ``max_per_host`` limit of ``session``, so dozens may be submitted at
+    once:
+
+    >>> futures = [submit('GET', url) for url in urls]
+    >>> for future in as_completed(futures):
+    ...     r = future.result()  # the Response, or raises
+
+    :param session: session to use; defaults to the module-wide session
+    :type session: :class:`Session`
+    :returns: :class:`Future` whose result is the :class:`Response`
+    :rtype: :class:`Future`
+
+    """
+
+    session = session or _session
+    return _worker_pool().submit(session.request, method, url, **kwargs)
+
+
+def get_async(url, **kwargs):
+    """Start a GET request. Arguments as for :func:`submit`.
+
+    :returns: :class:`Future`
+
+    """
+
+    kwargs.setdefault('allow_redirects', True)
+    return submit('GET', url, **kwargs)
+
+
+def post_async(url, **kwargs):
+    """Start a POST request. Arguments as for :func:`submit`.
+
+    :returns: :class:`Future`
+
+    """
+
+    return submit('POST', url, **kwargs)
+
+
+def as_completed(futures, timeout=None):
+    """Yield ``futures`` as they finish.
+
+    :param futures: :class:`Future` instances
+    :type futures: ``list``
+    :param timeout: seconds to wait for all of them
+    :type timeout: ``float``
+    :raises: :class:`socket.timeout` if ``timeout`` passes first
+
+    """
+
+    finished = Queue.Queue()
+    futures = list(futures)
+    for future in futures:
+        future.add_done_callback(finished.put)
+
+    deadline = None if timeout is None else time.time() + timeout
+    for _ in futures:
+        wait = None if deadline is None else max(0, deadline - time.time())
+        try:
+            yield finished.get(True, wait)
+        except Queue.Empty:
+            raise socket.timeout('calls still running after %ss' % timeout)
+
+
+def fetch_many(requests, max_workers=MAX_WORKERS, session=None):
+    """Run several requests concurrently. Returns results in order.
+
+    Each item of ``requests`` is either a URL to ``GET`` or a ``dict`` of
+    keyword arguments for :meth:`Session.request` (``method`` defaults to
+    ``GET``, which then also follows redirects)::
+
+        responses = fetch_many([
+            'https://api.github.com/repos/a/b/pulls',
+            {'url': 'https://api.trello.com/1/boards/x', 'params': {...}},
+            {'method': 'POST', 'url': url, 'data': {...}},
+        ])
+
+    Requests share the pooled connections of ``session`` and are still
+    subject to its ``max_per_host`` limit. They can't be streamed: an
+    unread response holds its host slot, and the requests still waiting
+    for one would never get it. Use :func:`submit` for streaming.
+
+    :param requests: URLs and/or request ``dict``s
+    :type requests: ``list``
+    :param max_workers: maximum number of requests in flight. Requests
+        run on the shared :class:`WorkerPool` of this size.
+    :type max_workers: ``int``
+    :param session: session to use; defaults to the module-wide session
+    :type session: :class:`Session`
+    :returns: for each request, its :class:`Response` or the exception it
+        raised (e.g. :class:`socket.error`). HTTP error statuses are
+        returned as responses, as by :func:`request`.
+    :rtype: ``list``
+    :raises: :class:`ValueError` if a request asks for ``stream=True``
+
+    """
+
+    session = session or _session
+    items = [item if isinstance(item, dict) else {'url': item}
+             for item in requests]
+    if any(item.get('stream') for item in items):
+        raise ValueError('fetch_many() responses are read in full; '
+                         'use submit() to stream')
+
+    pool = _worker_pool(max_workers)
+    futures = []
+    for item in items:
+        kwargs = dict(item)
+        kwargs.setdefault('method', 'GET')
+        if kwargs['method'] == 'GET':
+            kwargs.setdefault('allow_redirects', True)
+        futures.append(pool.submit(session.request, **kwargs))
+
+    return [future.exception() or future.result() for future in futures]
+
+
+_link_pattern = re.compile(r'<([^>]+)>\s*;\s*rel="?([^",;]+)"?')
+
+
+def parse_link_header(value):
+    """Parse an RFC 5988 ``Link`` header (as sent by GitHub).
+
+    :param value: value of ``Link`` header
+    :type value: ``str``
+    :returns: ``{rel: url}``
+    :rtype: ``dict``
+
+    """
+
+    links = {}
+    for url, rels in _link_pattern.findall(value or ''):
+        for rel in rels.split():
+            links[rel] = url
+    return links
+
+
+def _with_params(url, **params):
+    """Return ``url`` with query parameters ``params`` replaced."""
+    scheme, netloc, path, query, fragment = urlparse.urlsplit(_utf8(url))
+    query = urlparse.parse_qs(query, keep_blank_values=True)
+    query.update((k, [str(v)]) for k, v in str_dict(params).items())
+    return urlparse.urlunsplit((scheme, netloc, path,
+                                urllib.urlencode(query, doseq=True), fragment))
+
+
+def _json_page(response):
+    """Return decoded JSON of ``response``, raising on HTTP errors."""
+    if isinstance(response, Exception):
+        raise response
+    response.raise_for_status()
+    return response.json()
+
+
+def paginate(url, style='link', params=None, page_size=100, items_key=None,
+             prefetch=4, session=None, **kwargs):
+    """Iterate over every item of a paginated API, page by page.
+
+    Supported pagination styles:
+
+    ``'link'``
+        GitHub: pages are JSON arrays and the next page is given by the
+        ``Link: <...>; rel="next"`` header. If there is also a
+        ``rel="last"`` link with a ``page`` parameter, the number of pages
+        is known.
+    ``'offset'``
+        Jira: ``startAt``/``maxResults`` parameters and a response object
+        with a ``total`` and the items under ``items_key`` (default
+        ``'issues'``).
+    ``'before'``
+        Trello: pages are JSON arrays, requested with ``limit`` and a
+        ``before`` cursor set to the ``id`` of the last item received.
+        Ends with the first page shorter than ``page_size``.
+
+    When the number of pages is known after the first page, up to
+    ``prefetch`` following pages are fetched concurrently with
+    :func:`fetch_many`. Items are still yielded in order, as soon as
+    their page has arrived.
+
+    :param url: URL of the first page
+    :type url: ``unicode``
+    :param style: ``'link'``, ``'offset'`` or ``'before'``
+    :type style: ``str``
+    :param params: URL parameters sent with every page
+    :type params: ``dict``
+    :param page_size: items per page to ask for (``per_page``,
+        ``maxResults`` or ``limit``)
+    :type page_size: ``int``
+    :param items_key: key of the items in ``'offset'`` responses
+    :type items_key: ``unicode``
+    :param prefetch: maximum number of pages fetched in parallel
+    :type prefetch: ``int``
+    :param session: session to use; defaults to the module-wide session
+    :type session: :class:`Session`
+    :param **kwargs: further arguments for :meth:`Session.request`, e.g.
+        ``headers`` or ``auth``. Pages are always read in full, so not
+        ``stream``.
+    :returns: iterator of decoded items
+    :raises: :class:`urllib2.HTTPError` if a page can't be fetched, or
+        :class:`ValueError` if ``stream=True`` is passed
 
     """
-    return request('POST', url, params, data, headers, cookies, files, auth,
-                   timeout, allow_redirects)
+
+    if kwargs.get('stream'):
+        raise ValueError('paginate() reads whole pages; stream is not '
+                         'supported')
+
+    session = session or _session
+    params = dict(params or {})
+    kwargs.setdefault('allow_redirects', True)
+
+    def fetch(urls):
+        return fetch_many([dict(kwargs, url=u) for u in urls],
+                          max_workers=prefetch, session=session)
+
+    def pages(urls):
+        """Fetch ``urls`` ``prefetch`` at a time, yielding decoded pages."""
+        for i in range(0, len(urls), prefetch):
+            for response in fetch(urls[i:i + prefetch]):
+                yield _json_page(response)
+
+    if style == 'link':
+        params.setdefault('per_page', page_size)
+        response = session.request('GET', url, params, **kwargs)
+        for item in _json_page(response):
+            yield item
+
+        links = parse_link_header(response.headers.get('link'))
+        last = urlparse.parse_qs(
+            urlparse.urlsplit(links.get('last', '')).query).get('page')
+        if 'next' in links and last:
+            urls = [_with_params(links['next'], page=n)
+                    for n in range(2, int(last[0]) + 1)]
+            for page in pages(urls):
+                for item in page:
+                    yield item
+            return
+
+        while 'next' in links:  # number of pages unknown
+            response = session.request('GET', links['next'], **kwargs)
+            for item in _json_page(response):
+                yield item
+            links = parse_link_header(response.headers.get('link'))
+
+    elif style == 'offset':
+        items_key = items_key or 'issues'
+        params.update(startAt=0, maxResults=page_size)
+        page = _json_page(session.request('GET', url, params, **kwargs))
+        for item in page[items_key]:
+            yield item
+
+        # The server may return fewer items per page than asked for
+        size = page.get('maxResults') or len(page[items_key])
+        total = page.get('total', 0)
+        if not size:
+            return
+        first = _with_params(url, **params)
+        urls = [_with_params(first, startAt=start)
+                for start in range(size, total, size)]
+        for page in pages(urls):
+            for item in page[items_key]:
+                yield item
+
+    elif style == 'before':
+        params['limit'] = page_size
+        while True:
+            page = _json_page(session.request('GET', url, params, **kwargs))
+            for item in page:
+                yield item
+            if len(page) < page_size:
+                return
+            params['before'] = page[-1]['id']
+
+    else:
+        raise ValueError('Unknown pagination style : {!r}'.format(style))
+
+
+def _content_type(filename):
+    """Return or guess mimetype of ``filename``.
+
+    :param filename: filename of file
+    :type filename: unicode/string
+    :returns: mime-type, e.g. ``text/html``
+    :rtype: :class:``str``
+
+    """
+
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+def _utf8(value):
+    """Return ``value`` encoded as UTF-8 if it is ``unicode``."""
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+class MultipartEncoder(object):
+    """Stream a ``multipart/form-data`` body without building it in memory.
+
+    File contents are read from disk in chunks of ``chunk_size`` bytes as
+    the body is sent. ``len()`` of the encoder is the size of the whole
+    body, worked out from the sizes of its parts, so it can be sent with a
+    ``Content-Length`` header.
+
+    The encoder is a read-only file-like object, which :mod:`httplib`
+    sends piece by piece. :meth:`rewind` starts it over, so a request can
+    be sent again after a retry or redirection.
+
+    :param fields: mapping of ``{name : value}`` pairs for normal form fields.
+    :type fields: :class:`dict`
+    :param files: dictionary of fieldnames/files elements for file data.
+        See :func:`encode_multipart_formdata`.
+    :type files: :class:`dict` of :class:`dicts`
+    :param chunk_size: bytes read from a file at a time
+    :type chunk_size: ``int``
+
+    """
+
+    def __init__(self, fields, files, chunk_size=65536):
+        self.boundary = '-----' + ''.join(random.choice(BOUNDARY_CHARS)
+                                          for i in range(30))
+        self.content_type = 'multipart/form-data; boundary=%s' % self.boundary
+        self.chunk_size = chunk_size
+        # Each part is a ``str`` or a ``(file, offset, size)`` tuple
+        self._parts = []
+        self._length = 0
+        # Files opened from ``path`` entries, closed by :meth:`close`
+        self._opened = []
+
+        # Normal form fields
+        for (name, value) in fields.items():
+            self._add('--%s\r\nContent-Disposition: form-data; '
+                      'name="%s"\r\n\r\n%s\r\n' % (
+                          self.boundary, _utf8(name), _utf8(value)))
+
+        # Files to upload
+        for name, d in files.items():
+            filename = d[u'filename']
+            if u'mimetype' in d:
+                mimetype = d[u'mimetype']
+            else:
+                mimetype = _content_type(filename)
+            self._add('--%s\r\nContent-Disposition: form-data; '
+                      'name="%s"; filename="%s"\r\n'
+                      'Content-Type: %s\r\n\r\n' % (
+                          self.boundary, _utf8(name), _utf8(filename),
+                          _utf8(mimetype)))
+            if u'path' in d:
+                file = open(d[u'path'], 'rb')
+                self._opened.append(file)
+                self._add_file(file)
+            elif u'file' in d:
+                self._add_file(d[u'file'])
+            else:
+                self._add(_utf8(d[u'content']))
+            self._add('\r\n')
+
+        self._add('--%s--\r\n' % self.boundary)
+        self.rewind()
+
+    def _add(self, data):
+        """Append ``data`` to the body, UTF-8-encoding it if necessary."""
+        data = _utf8(data)
+        self._parts.append(data)
+        self._length += len(data)
+
+    def _add_file(self, file):
+        """Append the rest of ``file`` to the body."""
+        offset = file.tell()
+        try:
+            size = os.fstat(file.fileno()).st_size - offset
+        except (AttributeError, OSError):  # not a real file
+            file.seek(0, os.SEEK_END)
+            size = file.tell() - offset
+            file.seek(offset)
+        self._parts.append((file, offset, size))
+        self._length += size
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def headers(self):
+        """``Content-Type`` and ``Content-Length`` headers for the body."""
+        return {
+            'Content-Type': self.content_type,
+            'Content-Length': str(self._length),
+        }
+
+    def rewind(self):
+        """Start reading the body from the beginning again."""
+        self._chunks = self._iter_chunks()
+        self._buffer = ''
+
+    def _iter_chunks(self):
+        for part in self._parts:
+            if isinstance(part, str):
+                yield part
+                continue
+            file, offset, size = part
+            file.seek(offset)
+            while size > 0:
+                chunk = file.read(min(self.chunk_size, size))
+                if not chunk:
+                    raise IOError('%r shrank while being uploaded' % file)
+                size -= len(chunk)
+                yield chunk
+
+    def read(self, amt=None):
+        """Return up to ``amt`` bytes of the body, or all that's left."""
+        buf = [self._buffer]
+        have = len(self._buffer)
+        for chunk in self._chunks:
+            buf.append(chunk)
+            have += len(chunk)
+            if amt is not None and have >= amt:
+                break
+        data = ''.join(buf)
+        if amt is None:
+            self._buffer = ''
+            return data
+        self._buffer = data[amt:]
+        return data[:amt]
+
+    def close(self):
+        """Close files opened from ``path`` entries."""
+        for file in self._opened:
+            file.close()
 
 
 def encode_multipart_formdata(fields, files):
@@ -364,63 +2986,16 @@ def encode_multipart_formdata(fields, files):
 
     - ``fieldname`` is the name of the field in the HTML form.
     - ``mimetype`` is optional. If not provided, :mod:`mimetypes` will be used to guess the mimetype, or ``application/octet-stream`` will be used.
+    - Instead of ``content``, give the ``path`` of a file or an open
+      ``file`` to read the data from.
 
-    """
-
-    def get_content_type(filename):
-        """Return or guess mimetype of ``filename``.
+    :func:`request` sends ``files`` with a :class:`MultipartEncoder`
+    instead, which never holds the whole body in memory.
 
-        :param filename: filename of file
-        :type filename: unicode/string
-        :returns: mime-type, e.g. ``text/html``
-        :rtype: :class:``str``
-
-        """
-
-        return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
-
-    boundary = '-----' + ''.join(random.choice(BOUNDARY_CHARS)
-                                 for i in range(30))
-    CRLF = '\r\n'
-    output = []
-
-    # Normal form fields
-    for (name, value) in fields.items():
-        if isinstance(name, unicode):
-            name = name.encode('utf-8')
-        if isinstance(value, unicode):
-            value = value.encode('utf-8')
-        output.append('--' + boundary)
-        output.append('Content-Disposition: form-data; name="%s"' % name)
-        output.append('')
-        output.append(value)
+    """
 
-    # Files to upload
-    for name, d in files.items():
-        filename = d[u'filename']
-        content = d[u'content']
-        if u'mimetype' in d:
-            mimetype = d[u'mimetype']
-        else:
-            mimetype = get_content_type(filename)
-        if isinstance(name, unicode):
-            name = name.encode('utf-8')
-        if isinstance(filename, unicode):
-            filename = filename.encode('utf-8')
-        if isinstance(mimetype, unicode):
-            mimetype = mimetype.encode('utf-8')
-        output.append('--' + boundary)
-        output.append('Content-Disposition: form-data; '
-                      'name="%s"; filename="%s"' % (name, filename))
-        output.append('Content-Type: %s' % mimetype)
-        output.append('')
-        output.append(content)
-
-    output.append('--' + boundary + '--')
-    output.append('')
-    body = CRLF.join(output)
-    headers = {
-        'Content-Type': 'multipart/form-data; boundary=%s' % boundary,
-        'Content-Length': str(len(body)),
-    }
-    return (headers, body)
+    encoder = MultipartEncoder(fields, files)
+    try:
+        return (encoder.headers, encoder.read())
+    finally:
+        encoder.close()
@@ -30,6 +30,8 @@ import shutil
 import json
 import pickle
 import time
+import fcntl
+import atexit
 import logging
 import logging.handlers
 try:
@@ -37,6 +39,10 @@ try:
 except ImportError:  # pragma: no cover
     import xml.etree.ElementTree as ET
 
+# Implicit relative import: also works when this directory is the script
+# directory, as when background.py is run as a script
+import metrics
+
 
 ####################################################################
 # Some standard system icons
@@ -394,6 +400,161 @@ MATCH_SUBSTRING = 32
 MATCH_ALLCHARS = 64
 MATCH_ALL = 127
 
+####################################################################
+# Used by `Workflow.cached_data`
+####################################################################
+
+# Unpickled cache data kept for the life of the process, so long-lived
+# processes only decode a cache file again when it changes on disk.
+# Entries have the form ``{cache_path: ((inode, size, mtime), data)}``
+_cached_data_memo = {}
+
+
+def _file_key(path):
+    """Return ``(inode, size, mtime)`` of ``path``, which changes whenever
+    the file is replaced or rewritten.
+
+    """
+
+    st = os.stat(path)
+    return (st.st_ino, st.st_size, st.st_mtime)
+
+
+####################################################################
+# Used by `Workflow.get_password`
+####################################################################
+
+# Passwords already fetched from the Keychain by this process.
+# Entries have the form ``{(service, account): (password, expiry)}``,
+# where ``expiry`` is ``None`` without a ``password_cache_ttl``
+_password_memo = {}
+
+# Password session files used by this process, swept at exit
+_password_sessions = set()
+
+# Run by _start_password_sweepers in a new interpreter in _PACKAGE_PARENT
+_SWEEPER = ('import sys; from workflow.workflow import '
+            '_sweep_password_session; _sweep_password_session(sys.argv[1])')
+_PACKAGE_PARENT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _prune_password_session(path):
+    """Read the password session file at ``path``, dropping expired
+    entries from it.
+
+    Must be called with the session locked.
+
+    :returns: ``{'service\\taccount': [password, expiry]}``
+    :rtype: ``dict``
+
+    """
+
+    try:
+        with open(path, 'rb') as file:
+            data = json.load(file)
+    except IOError:  # no session
+        return {}
+    except ValueError:  # pragma: no cover
+        data = {}
+
+    now = time.time()
+    live = dict((k, v) for k, v in data.items() if v[1] > now)
+    if len(live) != len(data):  # don't keep expired passwords on disk
+        _write_password_session(path, live)
+    return live
+
+
+def _write_password_session(path, data):
+    """Replace the password session file at ``path`` with ``data``, or
+    delete it if ``data`` is empty. The file is only readable by the
+    current user.
+
+    Must be called with the session locked.
+
+    """
+
+    if not data:
+        if os.path.exists(path):
+            os.unlink(path)
+        return
+
+    tmp = '%s.%d' % (path, os.getpid())
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as file:
+        json.dump(data, file)
+    os.rename(tmp, path)
+
+
+def _sweep_password_session(path):
+    """Delete the entries of the password session file at ``path`` as
+    they expire, and return once the file is gone.
+
+    Runs in a detached process started by :func:`_start_password_sweepers`,
+    so passwords don't outlive their TTL on disk when no lookup comes
+    along to prune them. Returns at once if another sweeper is running.
+
+    """
+
+    with open(path + '.sweep', 'ab') as guard:
+        try:
+            fcntl.flock(guard, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:  # another sweeper has it
+            return
+        while True:
+            with open(path + '.lock', 'ab') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                live = _prune_password_session(path)
+                if not live:
+                    # Still holding the session lock, so a process that
+                    # adds a password after this can start a new sweeper
+                    fcntl.flock(guard, fcntl.LOCK_UN)
+                    return
+            expires = min(expiry for _, expiry in live.values())
+            time.sleep(max(0, expires - time.time()) + 0.1)
+
+
+def _start_password_sweepers():
+    """Leave a sweeper behind for each password session file this process
+    used that still exists, unless one is already watching it.
+
+    """
+
+    for path in _password_sessions:
+        if not os.path.exists(path):
+            continue
+        try:
+            with open(path + '.sweep', 'ab') as guard:
+                fcntl.flock(guard, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:  # sweeper running
+            continue
+        # Detached, and not holding Alfred's end of stdout open
+        with open(os.devnull, 'r+b') as devnull:
+            subprocess.Popen(
+                [sys.executable, '-c', _SWEEPER, path], cwd=_PACKAGE_PARENT,
+                stdin=devnull, stdout=devnull, stderr=devnull,
+                close_fds=True, preexec_fn=os.setsid)
+
+
+####################################################################
+# Workflow metadata, resolved once per process
+####################################################################
+
+# Name of the file in the workflow directory that caches the
+# ``info.plist`` values needed on every run, keyed by its mtime
+METADATA_FILE = '.info_plist.json'
+
+# Directory containing ``info.plist``
+_workflowdir = None
+
+# Parsed ``info.plist`` files: ``{path: (mtime, info)}``
+_info_memo = {}
+
+# Cached ``info.plist`` values: ``{path: (mtime, metadata)}``
+_metadata_memo = {}
+
+# Directories known to exist
+_created_dirs = set()
+
 
 ####################################################################
 # Keychain access errors
@@ -600,6 +761,12 @@ class Workflow(object):
         :param libraries: sequence of paths to directories containing
             libraries. These paths will be prepended to ``sys.path``.
         :type libraries: :class:`tuple` or :class:`list`
+        :param password_cache_ttl: if non-zero, passwords read from the
+            Keychain are also kept this many seconds in a session file
+            readable only by the current user, so other processes needn't
+            call ``security`` again. A detached process deletes them from
+            it as they expire. See :meth:`Workflow.get_password`.
+        :type password_cache_ttl: :class:`int`
 
     """
 
@@ -608,12 +775,14 @@ class Workflow(object):
     item_class = Item
 
     def __init__(self, default_settings=None, input_encoding='utf-8',
-                 normalization='NFC', capture_args=True, libraries=None):
+                 normalization='NFC', capture_args=True, libraries=None,
+                 password_cache_ttl=0):
 
         self._default_settings = default_settings or {}
         self._input_encoding = input_encoding
         self._normalizsation = normalization
         self._capture_args = capture_args
+        self._password_cache_ttl = password_cache_ttl
         self._workflowdir = None
         self._settings_path = None
         self._settings = None
@@ -657,7 +826,7 @@ class Workflow(object):
         """
 
         if not self._bundleid:
-            self._bundleid = unicode(self.info['bundleid'], 'utf-8')
+            self._bundleid = self._metadata['bundleid']
         return self._bundleid
 
     @property
@@ -670,7 +839,7 @@ class Workflow(object):
         """
 
         if not self._name:
-            self._name = unicode(self.info['name'], 'utf-8')
+            self._name = self._metadata['name']
         return self._name
 
     # Workflow utility methods -----------------------------------------
@@ -773,13 +942,18 @@ class Workflow(object):
 
         """
 
+        global _workflowdir
+
+        if not self._workflowdir and _workflowdir:
+            self._workflowdir = _workflowdir
+
         if not self._workflowdir:
             # climb the directory tree until we find `info.plist`
             dirpath = os.path.abspath(os.path.dirname(__file__))
             while True:
                 dirpath = os.path.dirname(dirpath)
                 if os.path.exists(os.path.join(dirpath, 'info.plist')):
-                    self._workflowdir = dirpath
+                    self._workflowdir = _workflowdir = dirpath
                     break
                 elif dirpath == '/':  # pragma: no cover
                     # no `info.plist` found
@@ -935,13 +1109,22 @@ class Workflow(object):
         cache_path = self.cachefile('%s.cache' % name)
         age = self.cached_data_age(name)
         if (age < max_age or max_age == 0) and os.path.exists(cache_path):
-            with open(cache_path, 'rb') as file:
+            # mtime alone may not change if the file is rewritten within
+            # its resolution, but cache_data() replaces it with a new inode
+            file_key = _file_key(cache_path)
+            memo = _cached_data_memo.get(cache_path)
+            if memo and memo[0] == file_key:
+                return memo[1]
+            with metrics.phase('cache_load'), open(cache_path, 'rb') as file:
                 self.logger.debug('Loading cached data from : %s',
                                   cache_path)
-                return pickle.load(file)
+                data = pickle.load(file)
+            _cached_data_memo[cache_path] = (file_key, data)
+            return data
         if not data_func:
             return None
-        data = data_func()
+        with metrics.phase('fetch'):
+            data = data_func()
         self.cache_data(name, data)
         return data
 
@@ -959,14 +1142,20 @@ class Workflow(object):
 
         cache_path = self.cachefile('%s.cache' % name)
 
+        _cached_data_memo.pop(cache_path, None)
+
         if data is None:
             if os.path.exists(cache_path):
                 os.unlink(cache_path)
                 self.logger.debug('Deleted cache file : %s', cache_path)
             return
 
-        with open(cache_path, 'wb') as file:
+        # Replace the file atomically, so readers never see half of it
+        tmp = '%s.%d' % (cache_path, os.getpid())
+        with metrics.phase('cache_save'), open(tmp, 'wb') as file:
             pickle.dump(data, file)
+        os.rename(tmp, cache_path)
+        _cached_data_memo[cache_path] = (_file_key(cache_path), data)
         self.logger.debug('Cached data saved at : %s', cache_path)
 
     def cached_data_fresh(self, name, max_age):
@@ -1002,6 +1191,7 @@ class Workflow(object):
             return 0
         return time.time() - os.stat(cache_path).st_mtime
 
+    @metrics.timed('filter')
     def filter(self, query, items, key=lambda x: x, ascending=False,
                include_score=False, min_score=0, max_results=0,
                match_on=MATCH_ALL, fold_diacritics=True):
@@ -1324,6 +1514,7 @@ class Workflow(object):
         self._items.append(item)
         return item
 
+    @metrics.timed('render')
     def send_feedback(self):
         """Print stored items to console/Alfred as XML."""
         root = ET.Element('items')
@@ -1357,6 +1548,7 @@ class Workflow(object):
         """
         if not service:
             service = self.bundleid
+        self._forget_password(service, account)
         try:
             retcode, output = self._call_security('add-generic-password',
                                                   service, account,
@@ -1387,13 +1579,39 @@ class Workflow(object):
         :returns: account password
         :rtype: str
 
+        Each password is only fetched from the Keychain once per process.
+        If :class:`Workflow` was created with ``password_cache_ttl``, it is
+        only remembered for that many seconds, so long-running processes
+        notice changed passwords, and is shared with other processes for
+        as long.
+
         """
 
         if not service:
             service = self.bundleid
-        retcode, password = self._call_security('find-generic-password',
-                                                service, account, '-w')
-        self.logger.debug('get_password : %s:%s', service, account)
+
+        key = (service, account)
+        now = time.time()
+        if key in _password_memo:
+            password, expiry = _password_memo[key]
+            if expiry is None or expiry > now:
+                return password
+
+        password = expiry = None
+        if self._password_cache_ttl:
+            password, expiry = self._load_password_session().get(
+                '\t'.join(key), (None, None))
+
+        if password is None:
+            with metrics.phase('keychain'):
+                retcode, password = self._call_security(
+                    'find-generic-password', service, account, '-w')
+            self.logger.debug('get_password : %s:%s', service, account)
+            if self._password_cache_ttl:
+                expiry = now + self._password_cache_ttl
+                self._update_password_session(key, password)
+
+        _password_memo[key] = (password, expiry)
         return password
 
     def delete_password(self, account, service=None):
@@ -1411,10 +1629,78 @@ class Workflow(object):
 
         if not service:
             service = self.bundleid
+        self._forget_password(service, account)
         retcode, output = self._call_security('delete-generic-password',
                                               service, account)
         self.logger.debug('delete_password : %s:%s', service, account)
 
+    @property
+    def _password_session_path(self):
+        """Path to the session file used by ``password_cache_ttl``."""
+        return self.cachefile('.password_session')
+
+    def _lock_password_session(self):
+        """Lock the password session file against other processes.
+
+        :returns: open lock file. Close it to release the lock.
+
+        """
+
+        file = open(self._password_session_path + '.lock', 'ab')
+        fcntl.flock(file, fcntl.LOCK_EX)
+        return file
+
+    def _load_password_session(self):
+        """Load unexpired entries from the password session file.
+
+        :returns: ``{'service\\taccount': [password, expiry]}``
+        :rtype: ``dict``
+
+        """
+
+        path = self._password_session_path
+        if not os.path.exists(path):
+            return {}
+        self._use_password_session(path)
+        with self._lock_password_session():
+            return _prune_password_session(path)
+
+    def _update_password_session(self, key, password):
+        """Store (or with ``password=None`` remove) ``key`` in the session
+        file.
+
+        """
+
+        name = '\t'.join(key)
+        path = self._password_session_path
+        self._use_password_session(path)
+        with self._lock_password_session():
+            data = _prune_password_session(path)
+            if password is None:
+                if name not in data:
+                    return
+                del data[name]
+            else:
+                data[name] = [password, time.time() + self._password_cache_ttl]
+            _write_password_session(path, data)
+
+    def _use_password_session(self, path):
+        """Have this process make sure the session file at ``path`` is
+        deleted once its passwords expire, even if it's never read again.
+
+        """
+
+        if not _password_sessions:
+            atexit.register(_start_password_sweepers)
+        _password_sessions.add(path)
+
+    def _forget_password(self, service, account):
+        """Drop cached copies of the password at ``service/account``."""
+        key = (service, account)
+        _password_memo.pop(key, None)
+        if os.path.exists(self._password_session_path):
+            self._update_password_session(key, None)
+
     ####################################################################
     # Methods for workflow:* magic args
     ####################################################################
@@ -1519,9 +1805,60 @@ class Workflow(object):
 
         """
 
-        self._info = plistlib.readPlist(self._info_plist)
+        mtime = os.stat(self._info_plist).st_mtime
+        memo = _info_memo.get(self._info_plist)
+        if not memo or memo[0] != mtime:
+            memo = _info_memo[self._info_plist] = (
+                mtime, plistlib.readPlist(self._info_plist))
+        self._info = memo[1]
         self._info_loaded = True
 
+    @property
+    def _metadata(self):
+        """``bundleid`` and ``name`` from ``info.plist``.
+
+        Parsing ``info.plist`` is comparatively slow, so the values are
+        cached in :const:`METADATA_FILE` in the workflow directory and
+        only re-read from ``info.plist`` when its mtime changes.
+
+        :returns: ``{'mtime': ..., 'bundleid': ..., 'name': ...}``
+        :rtype: ``dict``
+
+        """
+
+        mtime = os.stat(self._info_plist).st_mtime
+        memo = _metadata_memo.get(self._info_plist)
+        if memo and memo[0] == mtime:
+            return memo[1]
+
+        path = self.workflowfile(METADATA_FILE)
+        metadata = None
+        try:
+            with open(path, 'rb') as file:
+                metadata = json.load(file)
+        except (IOError, ValueError):
+            pass
+
+        if not metadata or metadata.get('mtime') != mtime:
+            def decode(value):
+                if isinstance(value, unicode):
+                    return value
+                return unicode(value, 'utf-8')
+
+            metadata = {'mtime': mtime,
+                        'bundleid': decode(self.info['bundleid']),
+                        'name': decode(self.info['name'])}
+            tmp = '%s.%d' % (path, os.getpid())
+            try:
+                with open(tmp, 'wb') as file:
+                    json.dump(metadata, file)
+                os.rename(tmp, path)
+            except (IOError, OSError):  # pragma: no cover
+                self.logger.debug('Could not write %s', path)
+
+        _metadata_memo[self._info_plist] = (mtime, metadata)
+        return metadata
+
     def _create(self, dirpath):
         """Create directory `dirpath` if it doesn't exist
 
@@ -1532,8 +1869,11 @@ class Workflow(object):
 
         """
 
+        if dirpath in _created_dirs:
+            return dirpath
         if not os.path.exists(dirpath):
             os.makedirs(dirpath)
+        _created_dirs.add(dirpath)
         return dirpath
 
     def _call_security(self, action, service, account, *args):